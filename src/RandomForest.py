@@ -1,187 +1,1103 @@
-import xarray as xr
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
+import os
+import json
+import hashlib
+import math
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
+if __package__:
+    from ._lazy import lazy_import
+    from .runlog import RunLog
+    from .catalog import get_path
+else:
+    from _lazy import lazy_import
+    from runlog import RunLog
+    from catalog import get_path
 
-def read_data(years, month, region, datapath):
+# pandas/xarray/sklearn are only imported when first used
+pd = lazy_import('pandas')
+xr = lazy_import('xarray')
+sk_base = lazy_import('sklearn.base')
+sk_cluster = lazy_import('sklearn.cluster')
+sk_decomposition = lazy_import('sklearn.decomposition')
+sk_ensemble = lazy_import('sklearn.ensemble')
+sk_inspection = lazy_import('sklearn.inspection')
+sk_metrics = lazy_import('sklearn.metrics')
+sk_model_selection = lazy_import('sklearn.model_selection')
+
+
+# tables already read in this session: {path: (mtime, DataFrame)}
+_table_cache = {}
+
+def read_table(path, cachedir=None):
+    """
+    Read one excel table through a memory cache and, if cachedir is given,
+    an on-disk parquet copy there. Both are invalidated when the excel file
+    is modified; without a parquet engine only the memory cache is used.
+    """
+    mtime = os.path.getmtime(path)
+    if path in _table_cache and _table_cache[path][0] == mtime:
+        return _table_cache[path][1]
+
+    cachefile = None
+    if cachedir is not None:
+        name = os.path.splitext(os.path.basename(path))[0]
+        cachefile = os.path.join(cachedir, name + '.parquet')
+    table = None
+    if cachefile is not None and os.path.exists(cachefile) and os.path.getmtime(cachefile) >= mtime:
+        try:
+            table = pd.read_parquet(cachefile)
+        except ImportError:
+            cachefile = None
+    if table is None:
+        table = pd.read_excel(path, index_col=0)
+        if cachefile is not None:
+            os.makedirs(cachedir, exist_ok=True)
+            try:
+                table.to_parquet(cachefile)
+            except ImportError:
+                # no pyarrow/fastparquet: memory cache only
+                pass
+
+    _table_cache[path] = (mtime, table)
+    return table
+
+def read_data(years, month, region, datapath, keys=False, cachedir=None):
+    """
+    Concatenate SIM_{region}_{month}_{year}.xlsx of all years. Tables are
+    cached in memory, and as parquet in cachedir if given (see read_table).
+    keys=True keeps year/month/region as categorical columns.
+    """
     df = {}
 
     for year in years:
-        df[year] = pd.read_excel(datapath + f'SIM_{region}_{month}_{year}.xlsx', index_col=0)
+        df[year] = read_table(datapath + f'SIM_{region}_{month}_{year}.xlsx', cachedir)
 
     data = pd.concat(df, axis=0)
     data.reset_index(level=0, inplace=True)
-    data.drop(columns='level_0', inplace=True)
+    if keys:
+        data.rename(columns={'level_0': 'year'}, inplace=True)
+        data['year'] = data['year'].astype('category')
+        data['month'] = pd.Categorical([month]*len(data))
+        data['region'] = pd.Categorical([region]*len(data))
+    else:
+        data.drop(columns='level_0', inplace=True)
 
     return data
 
-def rf_importance(df, variants, target, random_state=42, test_size=0.2):
-    # Splitting the data
+# ===========================================================
+# Estimator backends and importance methods
+#   estimator:  'rf'          100-tree RandomForestRegressor (default)
+#               'hgb'         HistGradientBoostingRegressor, early stopping
+#               'rf_adaptive' forest grown until the OOB R2 converges
+#               or any sklearn regressor instance
+#   importance: 'impurity'    feature_importances_ (default)
+#               'permutation' permutation importance on the test set
+#               'oob'         permutation importance on the out-of-bag
+#                             samples of each tree, no train/test split
+# ===========================================================
+
+def make_estimator(estimator, random_state, n_estimators=100, oob=False):
+    if estimator == 'rf':
+        return sk_ensemble.RandomForestRegressor(n_estimators=n_estimators, random_state=random_state,
+                                     oob_score=oob)
+    elif estimator == 'hgb':
+        return sk_ensemble.HistGradientBoostingRegressor(early_stopping=True, random_state=random_state)
+    elif isinstance(estimator, str):
+        raise ValueError(f"Unknown estimator '{estimator}'")
+    model = sk_base.clone(estimator)
+    if 'random_state' in model.get_params():
+        model.set_params(random_state=random_state)
+    return model
+
+def fit_adaptive_forest(X, y, random_state, step=20, max_estimators=300, tol=0.005):
+    """
+    Grow a random forest by step trees (warm_start) until the OOB R2
+    changes by less than tol, or max_estimators is reached
+    """
+    model = sk_ensemble.RandomForestRegressor(n_estimators=step, oob_score=True, warm_start=True,
+                                  random_state=random_state)
+    model.fit(X, y)
+    previous = model.oob_score_
+    while model.n_estimators < max_estimators:
+        model.n_estimators += step
+        model.fit(X, y)
+        if abs(model.oob_score_ - previous) < tol:
+            break
+        previous = model.oob_score_
+    return model
+
+def fit_model(X, y, estimator, random_state, n_estimators=100, oob=False):
+    if estimator == 'rf_adaptive':
+        return fit_adaptive_forest(X, y, random_state)
+    model = make_estimator(estimator, random_state, n_estimators, oob)
+    model.fit(X, y)
+    return model
+
+def oob_permutation_importance(model, X, y, random_state):
+    """
+    Mean increase of the out-of-bag MSE of each tree when one feature is
+    permuted (Breiman, 2001)
+    """
+    X = np.asarray(X, dtype='float32')
+    y = np.asarray(y)
+    nsample = len(y)
+    rng = np.random.RandomState(random_state)
+    importance = np.zeros(X.shape[1])
+    for tree, inbag in zip(model.estimators_, model.estimators_samples_):
+        # out-of-bag rows: complement of the rows drawn for this tree
+        oob = np.ones(nsample, dtype=bool)
+        oob[inbag] = False
+        X_oob, y_oob = X[oob], y[oob]
+        base = sk_metrics.mean_squared_error(y_oob, tree.predict(X_oob))
+        for j in range(X.shape[1]):
+            X_perm = X_oob.copy()
+            X_perm[:,j] = rng.permutation(X_perm[:,j])
+            importance[j] += sk_metrics.mean_squared_error(y_oob, tree.predict(X_perm)) - base
+    return importance / len(model.estimators_)
+
+def rf_importance(df, variants, target, random_state=42, test_size=0.2,
+                  estimator='rf', importance='impurity', n_estimators=100,
+                  timings=None):
+    # timings (dict, optional): seconds spent in fit/predict/importance are added to it
+    tic = time.perf_counter()
     X = df[variants]
     y = df[target]
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
 
-    # Creating and training the Random Forest Regressor model
-    rf_model = RandomForestRegressor(n_estimators=100, random_state=random_state)
-    rf_model.fit(X_train, y_train)
+    if importance == 'oob':
+        # all samples are used for training, skill and importance from the OOB samples
+        if estimator not in ('rf', 'rf_adaptive'):
+            raise ValueError("importance='oob' needs a random forest estimator")
+        model = fit_model(X, y, estimator, random_state, n_estimators, oob=True)
+        toc_fit = time.perf_counter()
+        mse = sk_metrics.mean_squared_error(y, model.oob_prediction_)
+        r2 = model.oob_score_
+        toc_predict = time.perf_counter()
+        feature_importance = oob_permutation_importance(model, X, y, random_state)
+    else:
+        # Splitting the data
+        X_train, X_test, y_train, y_test = sk_model_selection.train_test_split(X, y, test_size=test_size, random_state=random_state)
 
-    # Predicting results
-    y_pred_rf = rf_model.predict(X_test)
+        # Creating and training the model
+        model = fit_model(X_train, y_train, estimator, random_state, n_estimators)
+        toc_fit = time.perf_counter()
 
-    # Mean Squared Error
-    mse = mean_squared_error(y_test, y_pred_rf)
-    # print(f'Mean Squared Error (Random Forest): {mse}')
+        # Predicting results
+        y_pred = model.predict(X_test)
 
-    # R-squared
-    r2 = r2_score(y_test, y_pred_rf)
-    # print(f'R-squared (Random Forest): {r2}')
+        # Mean Squared Error & R-squared
+        mse = sk_metrics.mean_squared_error(y_test, y_pred)
+        r2 = sk_metrics.r2_score(y_test, y_pred)
+        toc_predict = time.perf_counter()
 
-    # Getting feature importance
-    feature_importance = rf_model.feature_importances_
+        # Getting feature importance
+        if importance == 'impurity':
+            if not hasattr(model, 'feature_importances_'):
+                raise ValueError(f"{type(model).__name__} has no impurity importance, use importance='permutation'")
+            feature_importance = model.feature_importances_
+        elif importance == 'permutation':
+            feature_importance = sk_inspection.permutation_importance(model, X_test, y_test, n_repeats=5,
+                                                        random_state=random_state).importances_mean
+        else:
+            raise ValueError(f"Unknown importance '{importance}'")
+
+    if timings is not None:
+        toc = time.perf_counter()
+        timings['fit'] = timings.get('fit', 0) + toc_fit - tic
+        timings['predict'] = timings.get('predict', 0) + toc_predict - toc_fit
+        timings['importance'] = timings.get('importance', 0) + toc - toc_predict
 
     # add mse and r2
     output_index = variants + ['mse','r2']
     # Creating a DataFrame to store feature importance
     df_output = pd.DataFrame (
+        data={'value': np.r_[feature_importance, mse, r2]},
         index=output_index,
-        columns=['value'],
     )
-    
-    df_output.loc['mse','value'] = mse
-    df_output.loc['r2','value']  = r2
-    
-    # Matching feature importance with feature names
-    for feature, importance in zip(variants, feature_importance):
-        df_output.loc[feature, 'value'] = importance
 
-    # Sorting feature importance in descending order
-    # feature_importance_dict = dict(zip(variants, feature_importance))
-    # sorted_feature_importance = sorted(feature_importance_dict.items(), key=lambda x: x[1], reverse=True)
+    return df_output
 
-    # Printing each variable's impact on O3
-    # for feature, importance in sorted_feature_importance:
-    #     print(f'{feature}: {importance}')
+def benchmark_importance(cube, features, variants, target, pixels,
+                         configs=None, random_state=42):
+    """
+    Compare estimator backends / importance methods with the current RF
+    ('rf', 'impurity') on sample pixels of the cube (pixel, time, feature).
 
-    return df_output
+    configs: dict of name -> rf_importance keyword arguments
+    Returns DataFrame with seconds per pixel, mean R2 and the mean Spearman
+    rank correlation of the importances with the reference RF.
+    """
+    if configs is None:
+        configs = {
+            'rf_adaptive': dict(estimator='rf_adaptive'),
+            'hgb_permutation': dict(estimator='hgb', importance='permutation'),
+            'rf_oob': dict(estimator='rf', importance='oob'),
+        }
+    configs = {'rf': dict(estimator='rf', importance='impurity'), **configs}
+
+    def ranks(values):
+        return np.argsort(np.argsort(values))
+
+    results = {name: dict(seconds=[], r2=[], importance=[]) for name in configs}
+    for pixel in pixels:
+        df = pd.DataFrame(cube[pixel], columns=features)
+        for name, kwargs in configs.items():
+            start = time.perf_counter()
+            df_importance = rf_importance(df, variants, target, random_state=random_state, **kwargs)
+            results[name]['seconds'].append(time.perf_counter() - start)
+            results[name]['r2'].append(df_importance.loc['r2','value'])
+            results[name]['importance'].append(df_importance.loc[variants,'value'].values)
 
+    summary = pd.DataFrame(index=list(configs), columns=['seconds_per_pixel','r2','rank_corr'], dtype=float)
+    for name in configs:
+        corr = [np.corrcoef(ranks(imp), ranks(ref))[0,1]
+                for imp, ref in zip(results[name]['importance'], results['rf']['importance'])]
+        summary.loc[name] = [np.mean(results[name]['seconds']), np.mean(results[name]['r2']), np.mean(corr)]
+    return summary
+
+
+# ===========================================================
+# Warm-start hyperparameter sweep
+# ===========================================================
+
+def _sweep_config(args):
+    X, y, variants, test_size, random_state, n_estimators_grid = args
+    X_train, X_test, y_train, y_test = sk_model_selection.train_test_split(X, y, test_size=test_size, random_state=random_state)
+    model = sk_ensemble.RandomForestRegressor(n_estimators=n_estimators_grid[0], oob_score=True,
+                                  warm_start=True, random_state=random_state)
+    rows = []
+    seconds = 0.0
+    previous = None
+    for n_estimators in n_estimators_grid:
+        # warm_start: only the new trees are grown
+        model.n_estimators = n_estimators
+        tic = time.perf_counter()
+        model.fit(X_train, y_train)
+        seconds += time.perf_counter() - tic
+        importance = model.feature_importances_
+        row = dict(test_size=test_size, random_state=random_state, n_estimators=n_estimators,
+                   fit_seconds=seconds, oob_r2=model.oob_score_,
+                   test_r2=sk_metrics.r2_score(y_test, model.predict(X_test)))
+        if previous is None:
+            row['importance_change'] = np.nan
+            row['rank_corr'] = np.nan
+        else:
+            row['importance_change'] = np.abs(importance - previous).sum()
+            row['rank_corr'] = np.corrcoef(np.argsort(np.argsort(importance)),
+                                           np.argsort(np.argsort(previous)))[0,1]
+        row.update(zip(variants, importance))
+        rows.append(row)
+        previous = importance
+    return rows
+
+def sweep_rf(df, variants, target, n_estimators_grid=None, test_sizes=None,
+             random_states=None, n_workers=1):
+    """
+    Sweep n_estimators x test_size x random_state of rf_importance.
+
+    The feature matrix is built once and shared by all configurations; for
+    each split the forest grows incrementally (warm_start) through
+    n_estimators_grid, recording OOB and test R2, cumulative fit time and
+    the change of the importances since the previous size. Splits run in
+    parallel with n_workers > 1.
+    """
+    if n_estimators_grid is None:
+        n_estimators_grid = [10, 20, 40, 60, 80, 100, 150, 200, 300]
+    if test_sizes is None:
+        test_sizes = [0.2]
+    if random_states is None:
+        random_states = [42]
+    n_estimators_grid = sorted(n_estimators_grid)
+
+    X = df[variants].values.astype('float32')
+    y = df[target].values
+    tasks = [(X, y, variants, test_size, random_state, n_estimators_grid)
+             for test_size in test_sizes for random_state in random_states]
+
+    if n_workers == 1:
+        results = map(_sweep_config, tasks)
+        rows = [row for result in results for row in result]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rows = [row for result in executor.map(_sweep_config, tasks) for row in result]
+    return pd.DataFrame(rows)
+
+def cheapest_forest(sweep, tol=0.02):
+    """
+    Smallest n_estimators whose importances changed by less than tol (L1)
+    and whose OOB R2 is within tol of the best, for every configuration
+    """
+    sweep = sweep.copy()
+    best = sweep.groupby(['test_size','random_state'])['oob_r2'].transform('max')
+    stable = (sweep['importance_change'] < tol) & (sweep['oob_r2'] >= best - tol)
+    return sweep[stable].groupby(['test_size','random_state'])['n_estimators'].min()
 
 # ===========================================================
-# Read NETCDF file, create dataframe
+# Read NETCDF file
 # ===========================================================
 
 def read_ncdata(years, month, datapath):
     
-    chemlist = [datapath + f'{month}_{year}/{month}_{year}_chem.nc' for year in years]
-    mciplist = [datapath + f'{month}_{year}/{month}_{year}_mcip.nc' for year in years]
+    chemlist = [get_path(year, month, 'chem', rootdir=datapath) for year in years]
+    mciplist = [get_path(year, month, 'mcip', rootdir=datapath) for year in years]
 
     dsmcip = xr.open_mfdataset(mciplist)
     dschem = xr.open_mfdataset(chemlist)
 
     return dsmcip, dschem
 
-def create_dataframes(vars,ny,nx):
-    dfs = {}
-    for var in vars:
-        dfs[var] = pd.DataFrame(
-            index=range(ny),
-            columns=range(nx)
+def check_time_alignment(time1, time2):
+    """
+    The two scenarios are compared hour by hour: same length and the same
+    month/day/hour at every position
+    """
+    if len(time1) != len(time2):
+        raise ValueError(f'Time length differs between scenarios: {len(time1)} vs {len(time2)}')
+    stamp1 = pd.DatetimeIndex(time1).strftime('%m-%d %H')
+    stamp2 = pd.DatetimeIndex(time2).strftime('%m-%d %H')
+    mismatch = np.flatnonzero(stamp1 != stamp2)
+    if len(mismatch) > 0:
+        i = mismatch[0]
+        raise ValueError(f'Scenario times not aligned at step {i}: {time1[i]} vs {time2[i]}')
+
+def scenario_diff(ds1, ds2):
+    """
+    Lazy ds2 - ds1 matched hour by hour. The result keeps the time of ds1
+    and the time of ds2 as coordinate time2.
+    """
+    check_time_alignment(ds1.time.values, ds2.time.values)
+    time2 = ds2.time.values
+    diff = ds2.assign_coords(time=ds1.time.values) - ds1
+    return diff.assign_coords(time2=('time', time2))
+
+def read_ncdiff(years1, years2, month, datapath):
+    """
+    Lazy, chunked difference datasets ds(years2) - ds(years1) of mcip and chem
+    over the whole domain, nothing is read until the values are used
+    """
+    dsmcip1, dschem1 = read_ncdata(years1, month, datapath)
+    dsmcip2, dschem2 = read_ncdata(years2, month, datapath)
+    return scenario_diff(dsmcip1, dsmcip2), scenario_diff(dschem1, dschem2)
+
+# ===========================================================
+# Pixel-major feature cube (pixel, time, feature)
+# ===========================================================
+
+def read_surface(ds, var, ny, nx):
+    """
+    Surface layer of one variable as array (time, y, x)
+    """
+    return ds[var][:,0,:ny,:nx].values
+
+def data_source(years, month, ntime, years2=None, datapath=None, case='base'):
+    """
+    Description of the data a cube or checkpoint is built from: plain data
+    of years, or the scenario difference years2 - years. With datapath, the
+    resolved directory, the case and every input file with its mtime are
+    included, so reprocessed or relocated inputs do not match any more.
+    """
+    source = dict(source='plain' if years2 is None else 'diff',
+                  years=[str(year) for year in years], month=month, ntime=int(ntime))
+    if years2 is not None:
+        source['years2'] = [str(year) for year in years2]
+    if datapath is not None:
+        source['datapath'] = os.path.abspath(datapath)
+        source['case'] = case
+        source['files'] = []
+        for year in list(years) + list(years2 or []):
+            for kind in ['mcip', 'chem']:
+                path = os.path.abspath(get_path(year, month, kind, case=case, rootdir=datapath))
+                source['files'].append([path, os.path.getmtime(path)])
+    return source
+
+def read_cube_meta(cachefile):
+    """
+    Features and data source stored next to a cached cube, None if missing
+    """
+    try:
+        with open(cachefile + '.features', 'r') as file:
+            features = file.read().split()
+        with open(cachefile + '.source', 'r') as file:
+            source = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return features, source
+
+def load_pixel_cube(features, reader, ny, nx, cachefile=None, source=None):
+    """
+    Load the surface layer of all features once into a contiguous float32
+    array (pixel, time, feature), pixel = y*nx + x.
+
+    reader(var) returns the (time, y, x) array of one feature. If cachefile
+    (.npy) is given, the cube is written there and returned memory-mapped;
+    an existing cache is reused only if its features, grid and source
+    (see data_source: years, month, time length, plain/diff, input files)
+    all match, otherwise it is rebuilt.
+    """
+    if source is not None:
+        source = json.loads(json.dumps(source))
+    if cachefile is not None and os.path.exists(cachefile):
+        meta = read_cube_meta(cachefile)
+        if meta is not None and meta[0] == list(features) and meta[1] == source:
+            cube = np.load(cachefile, mmap_mode='r')
+            ntime = cube.shape[1] if source is None else source['ntime']
+            if cube.shape[0] == ny*nx and cube.shape[1] == ntime:
+                print(f'Using cached cube {cachefile}')
+                return cube
+            del cube
+        print(f'Cached cube {cachefile} belongs to another run, rebuilding')
+
+    if cachefile is not None:
+        # the sidecars are written last, a cube without them is never reused
+        for suffix in ['.features', '.source']:
+            if os.path.exists(cachefile + suffix):
+                os.remove(cachefile + suffix)
+
+    cube = None
+    for i, var in enumerate(features):
+        data = reader(var)
+        nt = data.shape[0]
+        if cube is None:
+            shape = (ny*nx, nt, len(features))
+            if cachefile is not None:
+                cube = np.lib.format.open_memmap(cachefile, mode='w+', dtype='float32', shape=shape)
+            else:
+                cube = np.empty(shape, dtype='float32')
+        cube[:,:,i] = data.reshape(nt, ny*nx).T
+        print(f'Loaded {var}')
+
+    if cachefile is not None:
+        cube.flush()
+        del cube
+        with open(cachefile + '.features', 'w') as file:
+            file.write('\n'.join(features))
+        with open(cachefile + '.source', 'w') as file:
+            json.dump(source, file)
+        cube = np.load(cachefile, mmap_mode='r')
+    return cube
+
+def nc_reader(dsmcip, dschem, mcip_variants, ny, nx):
+    def reader(var):
+        if var in mcip_variants:
+            return read_surface(dsmcip, var, ny, nx)
+        return read_surface(dschem, var, ny, nx)
+    return reader
+
+# ===========================================================
+# Per-pixel random forests on a process pool
+# ===========================================================
+
+_cube = None
+
+def pixel_seed(random_state, y, x):
+    """
+    Deterministic random_state of pixel (y, x), independent of the worker
+    """
+    return int(np.random.SeedSequence([random_state, y, x]).generate_state(1)[0])
+
+def _init_worker(cachefile):
+    global _cube
+    _cube = np.load(cachefile, mmap_mode='r')
+
+def _fit_row(args):
+    y, nx, block, features, variants, target, random_state, rf_kwargs = args
+    # block is None when the worker reads its pixels from the memory-mapped cube
+    timings = {'read': 0.0}
+    if block is None:
+        tic = time.perf_counter()
+        block = np.ascontiguousarray(_cube[y*nx:(y+1)*nx])
+        timings['read'] += time.perf_counter() - tic
+    output = np.full((len(variants)+2, nx), np.nan, dtype='float32')
+    for x in range(nx):
+        tic = time.perf_counter()
+        df = pd.DataFrame(block[x], columns=features, copy=False)
+        timings['read'] += time.perf_counter() - tic
+        df_importance = rf_importance(df, variants, target,
+                                      random_state=pixel_seed(random_state, y, x),
+                                      timings=timings, **rf_kwargs)
+        output[:,x] = df_importance['value'].values.astype('float32')
+    return y, output, timings, os.getpid()
+
+# ===========================================================
+# Checkpoint: one row_{y}.npy of shape (output, x) per finished row
+# ===========================================================
+
+def init_checkpoint(checkpoint_dir, ny, nx, features, variants, target, random_state,
+                    rf_kwargs=None, source=None, extra=None):
+    """
+    Create the checkpoint directory, or check that an existing one belongs
+    to the same run (grid, features, target, RF settings and the data
+    source of data_source: years, month, plain/diff, input files, and the
+    extra keys). Returns the list of finished rows.
+    """
+    meta = dict(ny=ny, nx=nx, features=list(features), variants=list(variants),
+                target=target, random_state=random_state,
+                rf_kwargs=repr(sorted((rf_kwargs or {}).items())),
+                source=source, **(extra or {}))
+    meta = json.loads(json.dumps(meta))
+    metafile = os.path.join(checkpoint_dir, 'meta.json')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    if os.path.exists(metafile):
+        with open(metafile, 'r') as file:
+            saved = json.load(file)
+        differ = [key for key in sorted(set(saved) | set(meta)) if saved.get(key) != meta.get(key)]
+        if differ:
+            raise ValueError(f"Checkpoint in {checkpoint_dir} belongs to another run "
+                             f"(different {', '.join(differ)})")
+    else:
+        with open(metafile, 'w') as file:
+            json.dump(meta, file)
+    return [y for y in range(ny) if os.path.exists(os.path.join(checkpoint_dir, f'row_{y:03d}.npy'))]
+
+def save_checkpoint_row(checkpoint_dir, y, row_output, name='row'):
+    rowfile = os.path.join(checkpoint_dir, f'{name}_{y:03d}.npy')
+    with open(rowfile + '.tmp', 'wb') as file:
+        np.save(file, row_output)
+    os.replace(rowfile + '.tmp', rowfile)
+
+def read_checkpoint(checkpoint_dir):
+    """
+    Assemble the finished rows of a (possibly running) job into a map,
+    unfinished pixels are NaN. Returns float32 array (output, y, x) and
+    the output names.
+    """
+    with open(os.path.join(checkpoint_dir, 'meta.json'), 'r') as file:
+        meta = json.load(file)
+    output_varlist = meta['variants'] + ['mse','r2']
+    output = np.full((len(output_varlist), meta['ny'], meta['nx']), np.nan, dtype='float32')
+    for y in range(meta['ny']):
+        rowfile = os.path.join(checkpoint_dir, f'row_{y:03d}.npy')
+        if os.path.exists(rowfile):
+            output[:,y,:] = np.load(rowfile)
+    return output, output_varlist
+
+def run_pixels(cube, ny, nx, features, variants, target,
+               random_state=42, n_workers=None, checkpoint_dir=None, rf_kwargs=None,
+               logfile=None, source=None):
+    """
+    Fit rf_importance for every pixel of the cube (pixel, time, feature),
+    one grid row per task.
+
+    A memory-mapped cube is opened by every worker, so tasks only carry the
+    row index; an in-memory cube is sent row by row. n_workers=1 runs
+    in-process. With checkpoint_dir every finished row is saved to disk and
+    rows already there are skipped (resume), provided the checkpoint was
+    made from the same source (see data_source). rf_kwargs are passed to
+    rf_importance (estimator, importance, ...). Progress, stage times and
+    ETA are measured by a RunLog, written to logfile if given.
+    Returns float32 array (variants+['mse','r2'], y, x).
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if rf_kwargs is None:
+        rf_kwargs = {}
+    output = np.full((len(variants)+2, ny, nx), np.nan, dtype='float32')
+    cachefile = cube.filename if isinstance(cube, np.memmap) else None
+
+    todo = list(range(ny))
+    if checkpoint_dir is not None:
+        finished = init_checkpoint(checkpoint_dir, ny, nx, features, variants,
+                                   target, random_state, rf_kwargs, source)
+        for y in finished:
+            output[:,y,:] = np.load(os.path.join(checkpoint_dir, f'row_{y:03d}.npy'))
+        todo = [y for y in todo if y not in finished]
+        print(f'Resuming: {len(finished)} of {ny} rows finished')
+
+    log = RunLog(ny*nx, logfile=logfile, done=(ny-len(todo))*nx)
+
+    def collect(y, row_output, timings, worker):
+        tic = time.perf_counter()
+        output[:,y,:] = row_output
+        if checkpoint_dir is not None:
+            save_checkpoint_row(checkpoint_dir, y, row_output)
+        timings['write'] = time.perf_counter() - tic
+        log.update(nx, stages=timings, worker=worker, label=f'row {y}')
+
+    def task(y, inprocess=False):
+        block = cube[y*nx:(y+1)*nx] if (cachefile is None or inprocess) else None
+        return (y, nx, block, features, variants, target, random_state, rf_kwargs)
+
+    if n_workers == 1:
+        for y in todo:
+            collect(*_fit_row(task(y, inprocess=True)))
+        log.summary()
+        return output
+
+    initargs = (cachefile,) if cachefile is not None else ()
+    initializer = _init_worker if cachefile is not None else None
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer,
+                             initargs=initargs) as executor:
+        rows = iter(todo)
+        pending = set()
+        while True:
+            for y in rows:
+                pending.add(executor.submit(_fit_row, task(y)))
+                if len(pending) >= 2*n_workers:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(*future.result())
+    log.summary()
+    return output
+
+# ===========================================================
+# Regime-clustered attribution: one model per cluster of pixels
+# ===========================================================
+
+def pixel_descriptors(cube, n_components=20, random_state=42, chunk=1000):
+    """
+    Daily means of every feature, standardized per feature over the whole
+    domain and reduced by PCA. Returns array (pixel, n_components).
+    """
+    npix, nt, nfeat = cube.shape
+    nday = nt // 24
+    daily = np.empty((npix, nday, nfeat), dtype='float32')
+    for p0 in range(0, npix, chunk):
+        block = np.asarray(cube[p0:p0+chunk, :nday*24, :])
+        daily[p0:p0+chunk] = block.reshape(-1, nday, 24, nfeat).mean(axis=2)
+    mean = np.nanmean(daily, axis=(0,1))
+    std = np.nanstd(daily, axis=(0,1))
+    std[std == 0] = 1
+    zscore = np.nan_to_num((daily - mean) / std).reshape(npix, nday*nfeat)
+    n_components = min(n_components, zscore.shape[1])
+    return sk_decomposition.PCA(n_components=n_components, random_state=random_state).fit_transform(zscore)
+
+def cluster_pixels(cube, n_clusters=50, n_components=20, random_state=42):
+    """
+    Cluster the pixels by the similarity of their standardized time series.
+    Returns the cluster label of every pixel.
+    """
+    descriptors = pixel_descriptors(cube, n_components, random_state)
+    kmeans = sk_cluster.MiniBatchKMeans(n_clusters=n_clusters, n_init=3, random_state=random_state)
+    return kmeans.fit_predict(descriptors)
+
+def _fit_cluster(args):
+    k, block, features, variants, target, random_state, rf_kwargs = args
+    timings = {}
+    df = pd.DataFrame(block.reshape(-1, block.shape[-1]), columns=features, copy=False)
+    df_importance = rf_importance(df, variants, target, random_state=random_state,
+                                  timings=timings, **rf_kwargs)
+    return k, df_importance['value'].values.astype('float32'), timings, os.getpid()
+
+def run_clusters(cube, labels, ny, nx, features, variants, target,
+                 max_pixels=20, random_state=42, n_workers=None, rf_kwargs=None,
+                 checkpoint_dir=None, logfile=None, source=None):
+    """
+    Train one model per cluster on the pooled samples of up to max_pixels
+    member pixels and map the result back to every pixel of the cluster.
+    With checkpoint_dir every finished cluster is saved as cluster_{k}.npy
+    and skipped on resume, like the rows of run_pixels; progress is
+    measured by a RunLog written to logfile if given.
+    Returns float32 array (variants+['mse','r2'], y, x) like run_pixels.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if rf_kwargs is None:
+        rf_kwargs = {}
+    rng = np.random.RandomState(random_state)
+    clusters = np.unique(labels)
+    # member sampling depends on the order of the draws, so every cluster
+    # draws its members up front, also the finished ones
+    members = {}
+    for k in clusters:
+        members[k] = np.flatnonzero(labels == k)
+        if len(members[k]) > max_pixels:
+            members[k] = np.sort(rng.choice(members[k], max_pixels, replace=False))
+
+    output = np.full((len(variants)+2, ny*nx), np.nan, dtype='float32')
+    todo = list(clusters)
+    if checkpoint_dir is not None:
+        labels_hash = hashlib.sha1(np.ascontiguousarray(labels, dtype='int64').tobytes()).hexdigest()
+        init_checkpoint(checkpoint_dir, ny, nx, features, variants, target, random_state,
+                        rf_kwargs, source,
+                        extra=dict(mode='clusters', max_pixels=max_pixels, labels=labels_hash))
+        finished = [k for k in clusters
+                    if os.path.exists(os.path.join(checkpoint_dir, f'cluster_{k:03d}.npy'))]
+        for k in finished:
+            output[:, labels == k] = np.load(os.path.join(checkpoint_dir, f'cluster_{k:03d}.npy'))[:, None]
+        todo = [k for k in clusters if k not in finished]
+        print(f'Resuming: {len(finished)} of {len(clusters)} clusters finished')
+
+    log = RunLog(ny*nx, logfile=logfile, done=int(np.isin(labels, todo, invert=True).sum()))
+
+    def collect(k, values, timings, worker):
+        tic = time.perf_counter()
+        output[:, labels == k] = values[:, None]
+        if checkpoint_dir is not None:
+            save_checkpoint_row(checkpoint_dir, k, values, name='cluster')
+        timings['write'] = time.perf_counter() - tic
+        log.update(int((labels == k).sum()), stages=timings, worker=worker, label=f'cluster {k}')
+
+    def task(k):
+        block = np.asarray(cube[members[k]])
+        return (k, block, features, variants, target, int(np.random.SeedSequence([random_state, int(k)]).generate_state(1)[0]), rf_kwargs)
+
+    if n_workers == 1:
+        for k in todo:
+            collect(*_fit_cluster(task(k)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for result in executor.map(_fit_cluster, (task(k) for k in todo)):
+                collect(*result)
+    log.summary()
+    return output.reshape(-1, ny, nx)
+
+def compare_cluster_to_pixels(cube, nx, output, features, variants, target, pixels,
+                              random_state=42, rf_kwargs=None):
+    """
+    Deviation of the clustered attribution output from a per-pixel fit on
+    the sample pixels: mean absolute importance difference, Spearman rank
+    correlation of the importances and R2 of both.
+    """
+    if rf_kwargs is None:
+        rf_kwargs = {}
+
+    def ranks(values):
+        return np.argsort(np.argsort(values))
+
+    nvar = len(variants)
+    rows = []
+    for pixel in pixels:
+        y, x = divmod(int(pixel), nx)
+        df = pd.DataFrame(cube[pixel], columns=features)
+        df_importance = rf_importance(df, variants, target,
+                                      random_state=pixel_seed(random_state, y, x), **rf_kwargs)
+        per_pixel = df_importance['value'].values
+        clustered = output[:, y, x]
+        rows.append(dict(
+            y=y, x=x,
+            mae=np.mean(np.abs(per_pixel[:nvar] - clustered[:nvar])),
+            rank_corr=np.corrcoef(ranks(per_pixel[:nvar]), ranks(clustered[:nvar]))[0,1],
+            r2_pixel=per_pixel[nvar+1],
+            r2_cluster=clustered[nvar+1],
+        ))
+    return pd.DataFrame(rows)
+
+# ===========================================================
+# Batched multiple linear regression: all pixels at once
+# ===========================================================
+
+def _subset_r2(corr_xx, corr_xy, index, ridge=1e-8):
+    """
+    R2 of the standardized regression on the feature subset index, for all
+    pixels: r_S' C_SS^-1 r_S
+    """
+    if len(index) == 0:
+        return np.zeros(corr_xy.shape[0])
+    c = corr_xx[:, index][:, :, index] + ridge*np.eye(len(index))
+    r = corr_xy[:, index]
+    return np.einsum('pk,pk->p', r, np.linalg.solve(c, r[..., None])[..., 0])
+
+def lmg_importance(corr_xx, corr_xy):
+    """
+    LMG relative importance: R2 increment of each feature averaged over all
+    orderings, computed from the R2 of all 2^k feature subsets
+    """
+    nfeat = corr_xy.shape[1]
+    if nfeat > 12:
+        raise ValueError(f'LMG needs 2^k subset regressions, k = {nfeat} is too large')
+    r2 = np.stack([_subset_r2(corr_xx, corr_xy, [j for j in range(nfeat) if mask >> j & 1])
+                   for mask in range(2**nfeat)])
+    size = np.array([bin(mask).count('1') for mask in range(2**nfeat)])
+    weight = np.array([math.factorial(n)*math.factorial(nfeat-n-1) for n in range(nfeat)]) / math.factorial(nfeat)
+    importance = np.zeros(corr_xy.shape[::-1])
+    for j in range(nfeat):
+        for mask in range(2**nfeat):
+            if not mask >> j & 1:
+                importance[j] += weight[size[mask]] * (r2[mask | 1 << j] - r2[mask])
+    return importance
+
+def linear_importance(cube, features, variants, target, method='pratt', chunk=2000):
+    """
+    Standardized multiple linear regression of target on variants for every
+    pixel of the cube (pixel, time, feature), solved as one batched problem.
+
+    method: 'beta'  standardized regression coefficients
+            'pratt' beta * correlation, sums to R2
+            'lmg'   LMG decomposition of R2 (at most 12 variants)
+    Returns float32 array (variants+['mse','r2'], pixel) like run_pixels
+    before reshaping; mse is the in-sample residual variance.
+    """
+    ivar = [features.index(var) for var in variants]
+    itarget = features.index(target)
+    npix = cube.shape[0]
+    output = np.full((len(variants)+2, npix), np.nan, dtype='float32')
+
+    for p0 in range(0, npix, chunk):
+        block = np.asarray(cube[p0:p0+chunk], dtype='float64')
+        mean = block.mean(axis=1, keepdims=True)
+        std = block.std(axis=1, keepdims=True)
+        std[std == 0] = np.nan
+        zscore = (block - mean) / std
+        X = zscore[:, :, ivar]
+        y = zscore[:, :, itarget]
+        nt = block.shape[1]
+        corr_xx = np.nan_to_num(np.einsum('ptk,ptj->pkj', X, X) / nt)
+        corr_xy = np.nan_to_num(np.einsum('ptk,pt->pk', X, y) / nt)
+
+        beta = np.linalg.solve(corr_xx + 1e-8*np.eye(len(variants)), corr_xy[..., None])[..., 0]
+        r2 = np.einsum('pk,pk->p', beta, corr_xy)
+        if method == 'beta':
+            importance = beta.T
+        elif method == 'pratt':
+            importance = (beta*corr_xy).T
+        elif method == 'lmg':
+            importance = lmg_importance(corr_xx, corr_xy)
+        else:
+            raise ValueError(f"Unknown method '{method}'")
+
+        nblock = block.shape[0]
+        output[:len(variants), p0:p0+nblock] = importance
+        output[-2, p0:p0+nblock] = (1 - r2) * std[:, 0, itarget]**2
+        output[-1, p0:p0+nblock] = r2
+        print(f'pixel {p0+nblock} --> {(p0+nblock)/npix*100:.2f} %')
+
+    return output
+
+# ===========================================================
+# Output: importance maps as netcdf
+# ===========================================================
+
+estimator_names = {
+    'rf': 'Random Forest',
+    'rf_adaptive': 'Adaptive Random Forest',
+    'hgb': 'Gradient Boosting',
+}
+
+def importance_long_names(rf_kwargs=None, linear_method=None):
+    """
+    long names of importance / mse / r2 for the backend that produced them
+    """
+    if linear_method is not None:
+        return dict(
+            importance=f'Linear Regression Importance ({linear_method})',
+            mse='In-sample Residual Variance',
+            r2='In-sample R-squared',
         )
-    return dfs
+    rf_kwargs = rf_kwargs or {}
+    estimator = rf_kwargs.get('estimator', 'rf')
+    importance = rf_kwargs.get('importance', 'impurity')
+    if isinstance(estimator, str):
+        name = estimator_names.get(estimator, estimator)
+    else:
+        name = type(estimator).__name__
+    if importance == 'oob':
+        return dict(
+            importance=f'{name} Out-of-bag Permutation Importance',
+            mse='Out-of-bag Mean Squared Error',
+            r2='Out-of-bag R-squared',
+        )
+    if importance == 'permutation':
+        label = f'{name} Permutation Importance on Test Set'
+    else:
+        label = f'{name} Feature Importance'
+    return dict(
+        importance=label,
+        mse='Mean Squared Error of Test Set',
+        r2='R-squared of Test Set',
+    )
 
-def write_nc_to_df(years, month, datapath, 
-                   mcip_variants, chem_variants,
-                   variants, target,
-                   nx=None, ny=None):
-    
+def importance_to_dataset(output, variants, latitude, longitude, labels=None, attrs=None,
+                          long_names=None):
+    """
+    Convert the run_pixels output (variants+['mse','r2'], y, x) into a
+    Dataset with importance (feature, y, x), mse and r2 (y, x) and the grid
+    latitude/longitude, ready for spatial.plot_PRD_map:
+
+    plot_PRD_map(ds, ..., ds.importance.sel(feature='SFC_TMP'), ...)
+
+    long_names (see importance_long_names) label the variables after the
+    backend used, the default is the random forest impurity importance.
+    """
+    if long_names is None:
+        long_names = importance_long_names()
+    nvar = len(variants)
+    dataset = xr.Dataset(
+        data_vars=dict(
+            importance=(['feature','y','x'],output[:nvar],{'long name':long_names['importance'],'units':'1'}),
+            mse=(['y','x'],output[nvar],{'long name':long_names['mse']}),
+            r2=(['y','x'],output[nvar+1],{'long name':long_names['r2'],'units':'1'}),
+        ),
+        coords=dict(
+            feature=list(variants),
+            latitude=(['y','x'],np.asarray(latitude)),
+            longitude=(['y','x'],np.asarray(longitude)),
+        ),
+        attrs=dict(
+            createtime=pd.Timestamp.now().strftime('%Y-%m-%d'),
+        ),
+    )
+    if labels is not None:
+        dataset['cluster'] = (['y','x'],np.asarray(labels).reshape(output.shape[1:]),{'long name':'Pixel Cluster'})
+    if attrs is not None:
+        dataset.attrs.update(attrs)
+    return dataset
+
+def write_importance_nc(dataset, outpath):
+    compression=dict(zlib=True,complevel=5)
+    encoding={var:compression for var in dataset.data_vars}
+    dataset.to_netcdf(outpath,encoding=encoding)
+
+def attribute_cube(cube, ny, nx, features, variants, target, random_state=42,
+                   n_workers=None, checkpoint_dir=None, rf_kwargs=None,
+                   n_clusters=None, linear_method=None, logfile=None, source=None):
+    """
+    Per-pixel attribution, clustered attribution if n_clusters is given, or
+    batched linear regression if linear_method is given.
+    Returns the output array and the cluster labels (None per pixel).
+    """
+    if linear_method is not None:
+        output = linear_importance(cube, features, variants, target, method=linear_method)
+        return output.reshape(-1, ny, nx), None
+    if n_clusters is None:
+        output = run_pixels(cube, ny, nx, features, variants, target,
+                            random_state=random_state, n_workers=n_workers,
+                            checkpoint_dir=checkpoint_dir, rf_kwargs=rf_kwargs,
+                            logfile=logfile, source=source)
+        return output, None
+    labels = cluster_pixels(cube, n_clusters, random_state=random_state)
+    output = run_clusters(cube, labels, ny, nx, features, variants, target,
+                          random_state=random_state, n_workers=n_workers,
+                          rf_kwargs=rf_kwargs, checkpoint_dir=checkpoint_dir,
+                          logfile=logfile, source=source)
+    return output, labels
+
+def write_nc_importance(years, month, datapath, 
+                        mcip_variants, chem_variants,
+                        variants, target,
+                        nx=None, ny=None, n_workers=None, random_state=42,
+                        cachefile=None, checkpoint_dir=None, outpath=None,
+                        rf_kwargs=None, n_clusters=None, linear_method=None,
+                        logfile=None):
+    """
+    Importance maps of years as xr.Dataset (see importance_to_dataset),
+    written to outpath if given
+    """
     dsmcip, dschem = read_ncdata(years, month, datapath)
     if nx is None:
         nx = dsmcip.dims['x']
     if ny is None:
         ny = dsmcip.dims['y']
     print(f'nx = {nx}, ny = {ny}')
-    minutes_to_use = nx*ny*8.146/60
-    hours_to_use = nx*ny*8.146/3600
-    print(f'The process is expected to take up to {minutes_to_use:.2f} min, or {hours_to_use:.2f} h')
     
-    output_varlist = variants + ['mse','r2']
-    dfs_dict = create_dataframes(output_varlist,110,152)
+    features = mcip_variants + chem_variants
     
-    for y in range(ny):
-        for x in range(nx):
-            
-            process = (y*nx + x+1)/(ny*nx) *100
-            
-            df = pd.DataFrame(
-                index=dschem.time.values,
-                columns = mcip_variants + chem_variants
-            )
-            
-            for mcip_var in mcip_variants:
-                df[mcip_var] = dsmcip[mcip_var][:,0,y,x].squeeze().values
-            for chem_var in chem_variants:
-                df[chem_var] = dschem[chem_var][:,0,y,x].squeeze().values
-
-            df_importance = rf_importance(df,variants,target)
-            print(f'({x},{y}) --> {process:.2f} %')
-            
-            for var in output_varlist:
-                dfs_dict[var].loc[y,x] = df_importance.loc[var].values[0]
-                
-    return dfs_dict
-
-def write_ncdiff_to_df(years1, years2, month, datapath, 
-                       mcip_variants, chem_variants,
-                       variants, target,
-                       nx=None, ny=None):
+    reader = nc_reader(dsmcip, dschem, mcip_variants, ny, nx)
+    source = data_source(years, month, dsmcip.sizes['time'], datapath=datapath)
+    cube = load_pixel_cube(features, reader, ny, nx, cachefile=cachefile, source=source)
     
-    dsmcip1, dschem1 = read_ncdata(years1, month, datapath)
-    dsmcip2, dschem2 = read_ncdata(years2, month, datapath)
+    output, labels = attribute_cube(cube, ny, nx, features, variants, target,
+                                    random_state=random_state, n_workers=n_workers,
+                                    checkpoint_dir=checkpoint_dir, rf_kwargs=rf_kwargs,
+                                    n_clusters=n_clusters, linear_method=linear_method,
+                                    logfile=logfile, source=source)
+    
+    dataset = importance_to_dataset(output, variants,
+                                    dschem.latitude[:ny,:nx].values,
+                                    dschem.longitude[:ny,:nx].values,
+                                    labels=labels,
+                                    long_names=importance_long_names(rf_kwargs, linear_method),
+                                    attrs=dict(target=target, month=month,
+                                               years=str(list(years))))
+    if outpath is not None:
+        write_importance_nc(dataset, outpath)
+    
+    return dataset
+
+def write_ncdiff_importance(years1, years2, month, datapath, 
+                            mcip_variants, chem_variants,
+                            variants, target,
+                            nx=None, ny=None, n_workers=None, random_state=42,
+                            cachefile=None, checkpoint_dir=None, outpath=None,
+                            rf_kwargs=None, n_clusters=None, linear_method=None,
+                            logfile=None):
+    """
+    Importance maps of the difference years2 - years1 as xr.Dataset,
+    written to outpath if given
+    """
+    dsmcip, dschem = read_ncdiff(years1, years2, month, datapath)
     if nx is None:
-        nx = dsmcip1.dims['x']
+        nx = dsmcip.dims['x']
     if ny is None:
-        ny = dsmcip1.dims['y']
+        ny = dsmcip.dims['y']
     print(f'nx = {nx}, ny = {ny}')
-    minutes_to_use = nx*ny*13.51/60
-    hours_to_use = nx*ny*13.51/3600
-    print(f'The process is expected to take up to {minutes_to_use:.2f} min, or {hours_to_use:.2f} h')
     
-    output_varlist = variants + ['mse','r2']
-    dfs_dict = create_dataframes(output_varlist,110,152)
+    features = mcip_variants + chem_variants
+    
+    reader = nc_reader(dsmcip, dschem, mcip_variants, ny, nx)
+    source = data_source(years1, month, dsmcip.sizes['time'], years2=years2,
+                         datapath=datapath)
+    cube = load_pixel_cube(features, reader, ny, nx, cachefile=cachefile, source=source)
+    
+    output, labels = attribute_cube(cube, ny, nx, features, variants, target,
+                                    random_state=random_state, n_workers=n_workers,
+                                    checkpoint_dir=checkpoint_dir, rf_kwargs=rf_kwargs,
+                                    n_clusters=n_clusters, linear_method=linear_method,
+                                    logfile=logfile, source=source)
     
-    for y in range(ny):
-        for x in range(nx):
-            
-            process = (y*nx + x+1)/(ny*nx) *100
-            
-            df1 = pd.DataFrame(
-                index=dschem1.time.values,
-                columns = mcip_variants + chem_variants
-            )
-            df2 = pd.DataFrame(
-                index=dschem1.time.values,
-                columns = mcip_variants + chem_variants
-            )
-            
-            for mcip_var in mcip_variants:
-                df1[mcip_var] = dsmcip1[mcip_var][:,0,y,x].squeeze().values
-                df2[mcip_var] = dsmcip2[mcip_var][:,0,y,x].squeeze().values
-            for chem_var in chem_variants:
-                df1[chem_var] = dschem1[chem_var][:,0,y,x].squeeze().values
-                df2[chem_var] = dschem2[chem_var][:,0,y,x].squeeze().values
-
-            df1 = df1.reset_index()
-            df1.drop(columns='index',inplace=True)
-            df2 = df2.reset_index()
-            df2.drop(columns='index',inplace=True)
-            
-            diff = df2 - df1
-
-            df_importance = rf_importance(diff,variants,target)
-            print(f'({x},{y}) --> {process:.2f} %')
-            
-            for var in output_varlist:
-                dfs_dict[var].loc[y,x] = df_importance.loc[var].values[0]
-                
-    return dfs_dict
\ No newline at end of file
+    dataset = importance_to_dataset(output, variants,
+                                    dschem.latitude[:ny,:nx].values,
+                                    dschem.longitude[:ny,:nx].values,
+                                    labels=labels,
+                                    long_names=importance_long_names(rf_kwargs, linear_method),
+                                    attrs=dict(target=target, month=month,
+                                               years1=str(list(years1)),
+                                               years2=str(list(years2))))
+    if outpath is not None:
+        write_importance_nc(dataset, outpath)
+    
+    return dataset
+
+# ===========================================================
+# dict of DataFrames output, as used by the notebooks
+# ===========================================================
+
+def create_dataframes(vars,ny,nx):
+    dfs = {}
+    for var in vars:
+        dfs[var] = pd.DataFrame(
+            index=range(ny),
+            columns=range(nx)
+        )
+    return dfs
+
+def dataset_to_dfs(dataset):
+    """
+    Importance Dataset --> {var: DataFrame(y, x)} for every feature, mse and r2
+    """
+    output_varlist = [str(var) for var in dataset.feature.values] + ['mse','r2']
+    dfs_dict = {}
+    for var in output_varlist:
+        if var in ('mse','r2'):
+            values = dataset[var].values
+        else:
+            values = dataset.importance.sel(feature=var).values
+        dfs_dict[var] = pd.DataFrame(values)
+    return dfs_dict
+
+def write_nc_to_df(years, month, datapath, 
+                   mcip_variants, chem_variants,
+                   variants, target,
+                   nx=None, ny=None, **kwargs):
+    """
+    write_nc_importance returned as a dict of DataFrames {var: (y, x)};
+    kwargs are passed to write_nc_importance
+    """
+    dataset = write_nc_importance(years, month, datapath, mcip_variants, chem_variants,
+                                  variants, target, nx=nx, ny=ny, **kwargs)
+    return dataset_to_dfs(dataset)
+
+def write_ncdiff_to_df(years1, years2, month, datapath, 
+                       mcip_variants, chem_variants,
+                       variants, target,
+                       nx=None, ny=None, **kwargs):
+    """
+    write_ncdiff_importance returned as a dict of DataFrames {var: (y, x)};
+    kwargs are passed to write_ncdiff_importance
+    """
+    dataset = write_ncdiff_importance(years1, years2, month, datapath, mcip_variants, chem_variants,
+                                      variants, target, nx=nx, ny=ny, **kwargs)
+    return dataset_to_dfs(dataset)
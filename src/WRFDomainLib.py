@@ -1,178 +1,361 @@
 import numpy as np
-import cartopy.crs as ccrs
-import shapely.geometry as sgeom
+
+if __package__:
+    from ._lazy import lazy_import
+else:
+    from _lazy import lazy_import
+
+xr = lazy_import('xarray')
+ccrs = lazy_import('cartopy.crs')
+sgeom = lazy_import('shapely.geometry')
+import os
 from copy import copy
 import re  # regular expression
 
-def get_wps_param_value(wps_file, param_name, noutput, vartype):
+# ===========================================================
+# namelist.wps is parsed once into a WPSNamelist, cached by path and
+# modification time; all domain/projection helpers read from it
+# ===========================================================
+
+# repeat count | quoted string | comment | key = | end of group | value
+_namelist_token = re.compile(r"""\d+\*(?:'[^']*'|"[^"]*"|[^\s,=/!'"]+)|'[^']*'|"[^"]*"|![^\n]*|[A-Za-z_]\w*\s*=|/|[^\s,=/!'"]+""")
+
+def parse_namelist(wps_file):
+    """
+    Parse a Fortran namelist file into {group: {key: [raw values]}}.
+    Repeat counts (3*1) are expanded, comments dropped. A key given
+    twice in the same group is an error instead of being overwritten.
+    """
     with open(wps_file, 'r') as file:
-        for line in file.readlines():
-            words = re.split('=|\s+|,|\'', line)
-            while '' in words:
-                words.remove('')
-            if param_name in words:
-                if noutput==1:
-                    if vartype=='float':
-                        output = float(words[1])
-                    elif vartype=='int':
-                        output = int(words[1])
-                    else:
-                        output = words[1]
-                if noutput>1:
-                    if vartype=='float':
-                        output = np.ones((noutput,1))*1.1
-                        for i in np.arange(noutput):
-                            output[i] = float(words[1+i])
-                    elif vartype=='int':
-                        output = np.ones((noutput,1))
-                        for i in np.arange(noutput):
-                            output[i] = int(words[1+i])
-                    else:
-                        output = words[1:(1+noutput)]
-                    
+        text = file.read()
+    groups = {}
+    group, key = None, None
+    for token in _namelist_token.findall(text):
+        if token.startswith('!'):
+            continue
+        if group is None:
+            if token.startswith('&'):
+                group = token[1:].lower()
+                groups.setdefault(group, {})
+            continue
+        if token.startswith('&'):
+            raise ValueError(f'{wps_file}: group &{group} is not closed before {token}')
+        if token == '/':
+            group, key = None, None
+        elif token.endswith('='):
+            key = token[:-1].strip().lower()
+            if key in groups[group]:
+                raise ValueError(f'{wps_file}: {key} is given twice in &{group}')
+            groups[group][key] = []
+        elif key is None:
+            raise ValueError(f'{wps_file}: value {token} without a key in &{group}')
+        else:
+            repeat, star, value = token.partition('*')
+            if star and repeat.isdigit():
+                groups[group][key] += [value]*int(repeat)
+            else:
+                groups[group][key].append(token)
+    return groups
+
+def _convert(value, vartype):
+    if vartype == 'float':
+        return float(value.lower().replace('d', 'e'))
+    if vartype == 'int':
+        return int(value)
+    return value.strip('\'"')
+
+class WPSNamelist:
+    """
+    namelist.wps read once: the raw groups and typed per-domain arrays
+    (index 0 is d01).
+
+    Example:
+
+    wps = read_wps('namelist.wps')
+    wps.e_we, wps.dx, wps.parent_index
+    """
+    def __init__(self, wps_file):
+        self.wps_file = wps_file
+        self.groups = parse_namelist(wps_file)
+
+        self.max_dom = self.get('max_dom', 'int')
+        self.map_proj = self.get('map_proj')
+        self.ref_lat = self.get('ref_lat', 'float')
+        self.ref_lon = self.get('ref_lon', 'float')
+        self.truelat1 = self.get('truelat1', 'float')
+        self.truelat2 = self.get('truelat2', 'float')
+        self.stand_lon = self.get('stand_lon', 'float')
+
+        self.parent_id = self.get_array('parent_id', 'int')
+        self.parent_grid_ratio = self.get_array('parent_grid_ratio', 'int')
+        self.i_parent_start = self.get_array('i_parent_start', 'int')
+        self.j_parent_start = self.get_array('j_parent_start', 'int')
+        self.e_we = self.get_array('e_we', 'int')
+        self.e_sn = self.get_array('e_sn', 'int')
+
+        # parent_id is 1-based, d01 is its own parent
+        self.parent_index = np.maximum(self.parent_id - 1, 0)
+        if np.any(self.parent_index[1:] >= np.arange(1, self.max_dom)):
+            raise ValueError(f'{wps_file}: every nest must come after its parent')
+
+        # grid spacing of every domain from d01 and the nest ratios
+        self.dx = np.zeros(self.max_dom)
+        self.dy = np.zeros(self.max_dom)
+        self.dx[0] = self.get('dx', 'float')
+        self.dy[0] = self.get('dy', 'float')
+        for i in range(1, self.max_dom):
+            self.dx[i] = self.dx[self.parent_index[i]] / self.parent_grid_ratio[i]
+            self.dy[i] = self.dy[self.parent_index[i]] / self.parent_grid_ratio[i]
+
+        # analytic grids of calc_domain_grid, dropped with the namelist
+        self.grids = {}
+
+    def find(self, name, group=None):
+        """
+        Raw values of a key; an error if it is missing or found in more
+        than one group and no group is given
+        """
+        name = name.lower()
+        if group is not None:
+            return self.groups[group.lower()][name]
+        found = [g for g, values in self.groups.items() if name in values]
+        if not found:
+            raise KeyError(f'{name} not found in {self.wps_file}')
+        if len(found) > 1:
+            raise ValueError(f'{name} is given in &{", &".join(found)}, pass group=')
+        return self.groups[found[0]][name]
+
+    def get(self, name, vartype='', group=None):
+        return _convert(self.find(name, group)[0], vartype)
+
+    def get_array(self, name, vartype='', group=None, n=None):
+        if n is None:
+            n = self.max_dom
+        values = self.find(name, group)
+        if len(values) < n:
+            raise ValueError(f'{name} has {len(values)} values in {self.wps_file}, {n} expected')
+        output = [_convert(value, vartype) for value in values[:n]]
+        if vartype in ('float', 'int'):
+            return np.array(output, dtype=vartype)
+        return output
+
+_wps_cache = {}
+
+def read_wps(wps_file):
+    """
+    Parsed namelist.wps, re-read only when the file changes.
+    A WPSNamelist is returned as is.
+    """
+    if isinstance(wps_file, WPSNamelist):
+        return wps_file
+    path = os.path.abspath(wps_file)
+    mtime = os.path.getmtime(path)
+    cached = _wps_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, WPSNamelist(wps_file))
+        _wps_cache[path] = cached
+    return cached[1]
+
+def get_wps_param_value(wps_file, param_name, noutput, vartype):
+    wps = read_wps(wps_file)
+    if noutput==1:
+        return wps.get(param_name, vartype)
+    output = wps.get_array(param_name, vartype, n=noutput)
+    if vartype in ('float', 'int'):
+        output = output.astype(float).reshape(noutput, 1)
     return output
 
 def get_proj_lcc(wps_file):
-    ref_lat = get_wps_param_value(wps_file, 'ref_lat', 1, 'float')
-    ref_lon = get_wps_param_value(wps_file, 'ref_lon', 1, 'float')
-    par_lat1 = get_wps_param_value(wps_file, 'truelat1', 1, 'float')
-    par_lat2 = get_wps_param_value(wps_file, 'truelat2', 1, 'float')
-    standard_lon = get_wps_param_value(wps_file, 'stand_lon', 1, 'float')
-    
-    lccproj = ccrs.LambertConformal(central_longitude=ref_lon, central_latitude=ref_lat,
-                                    standard_parallels=(par_lat1, par_lat2), globe=None, cutoff=-30)
+    wps = read_wps(wps_file)
+    lccproj = ccrs.LambertConformal(central_longitude=wps.ref_lon, central_latitude=wps.ref_lat,
+                                    standard_parallels=(wps.truelat1, wps.truelat2), globe=None, cutoff=-30)
     return lccproj
 
+# sign of the (x, y) offset from the domain centre of each corner
+corner_signs = {'ll': (-1, -1), 'lr': (1, -1), 'ul': (-1, 1), 'ur': (1, 1)}
+
+def transform_xy(x, y, target, source):
+    """
+    Project arrays of any (equal) shape in one batch, returns (x, y)
+    with the input shape
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    xyz = target.transform_points(source, x.ravel(), y.ravel())
+    return xyz[:, 0].reshape(x.shape), xyz[:, 1].reshape(x.shape)
+
 def calc_corner_point_latlon(center_lat, center_lon, e_we, e_ns, dx, dy, wpsproj, latlonproj, loc):
-    center_x, center_y = wpsproj.transform_point(center_lon, center_lat, latlonproj)
-    if loc=='ll':
-        xpt = center_x - dx*e_we/2.0
-        ypt = center_y - dy*e_ns/2.0
-    elif loc=='lr':
-        xpt = center_x + dx*e_we/2.0
-        ypt = center_y - dy*e_ns/2.0
-    elif loc=='ul':
-        xpt = center_x - dx*e_we/2.0
-        ypt = center_y + dy*e_ns/2.0
-    elif loc=='ur':
-        xpt = center_x + dx*e_we/2.0
-        ypt = center_y + dy*e_ns/2.0
-    corner_lon, corner_lat = latlonproj.transform_point(xpt, ypt, wpsproj)
+    """
+    Corner of domains given their centres. All arguments but the
+    projections broadcast, so many domains are computed at once.
+    """
+    center_x, center_y = transform_xy(center_lon, center_lat, wpsproj, latlonproj)
+    sign_x, sign_y = corner_signs[loc]
+    xpt = center_x + sign_x*np.asarray(dx)*np.asarray(e_we)/2.0
+    ypt = center_y + sign_y*np.asarray(dy)*np.asarray(e_ns)/2.0
+    corner_lon, corner_lat = transform_xy(xpt, ypt, latlonproj, wpsproj)
     
     return corner_lon, corner_lat
 
 def calc_center_point_latlon(corner_lat_parent, corner_lon_parent, dx_parent, dy_parent, e_we, e_ns, dx, dy, i, j, wpsproj, latlonproj):
-    corner_x_parent, corner_y_parent = wpsproj.transform_point(corner_lon_parent, corner_lat_parent, latlonproj)
-    center_x_child = corner_x_parent + dx_parent*i + dx*e_we/2.0
-    center_y_child = corner_y_parent + dy_parent*j + dy*e_ns/2.0
-    center_lon_child, center_lat_child = latlonproj.transform_point(center_x_child, center_y_child, wpsproj)
+    corner_x_parent, corner_y_parent = transform_xy(corner_lon_parent, corner_lat_parent, wpsproj, latlonproj)
+    center_x_child = corner_x_parent + np.asarray(dx_parent)*i + np.asarray(dx)*e_we/2.0
+    center_y_child = corner_y_parent + np.asarray(dy_parent)*j + np.asarray(dy)*e_ns/2.0
+    center_lon_child, center_lat_child = transform_xy(center_x_child, center_y_child, latlonproj, wpsproj)
     
     return center_lon_child, center_lat_child
 
+def calc_domain_xy(wps_file, wpsproj=None):
+    """
+    Centre and lower-left corner of every domain in projected coordinates
+    (m). The nests are placed from their parent's corner without going
+    through lat/lon, so the whole chain costs one projected point.
+    Returns center_x, center_y, ll_x, ll_y, each (ndomain,)
+    """
+    wps = read_wps(wps_file)
+    if wpsproj is None:
+        wpsproj = get_proj_lcc(wps)
+    latlonproj = ccrs.Geodetic()
+
+    half_x = wps.dx*wps.e_we/2.0
+    half_y = wps.dy*wps.e_sn/2.0
+    center_x = np.zeros(wps.max_dom)
+    center_y = np.zeros(wps.max_dom)
+    center_x[0], center_y[0] = wpsproj.transform_point(wps.ref_lon, wps.ref_lat, latlonproj)
+    for i in range(1, wps.max_dom):
+        p = wps.parent_index[i]
+        center_x[i] = center_x[p] - half_x[p] + wps.dx[p]*wps.i_parent_start[i] + half_x[i]
+        center_y[i] = center_y[p] - half_y[p] + wps.dy[p]*wps.j_parent_start[i] + half_y[i]
+    return center_x, center_y, center_x - half_x, center_y - half_y
+
 def calc_wps_domain_info(wps_file):
-    ndomain = get_wps_param_value(wps_file, 'max_dom', 1, 'int')
-    proj_name = get_wps_param_value(wps_file, 'map_proj', 1, '')
-
-    grid_ratios = get_wps_param_value(wps_file, 'parent_grid_ratio', ndomain, 'int')
-    i_parent_start_array = get_wps_param_value(wps_file, 'i_parent_start', ndomain, 'int')
-    j_parent_start_array = get_wps_param_value(wps_file, 'j_parent_start', ndomain, 'int')
-    e_we_array = get_wps_param_value(wps_file, 'e_we', ndomain, 'int')
-    e_ns_array = get_wps_param_value(wps_file, 'e_sn', ndomain, 'int')
-    dx_d01 = get_wps_param_value(wps_file, 'dx', 1, 'float')
-    dy_d01 = get_wps_param_value(wps_file, 'dy', 1, 'float')
-    cen_lat_d01 = get_wps_param_value(wps_file, 'ref_lat', 1, 'float')
-    cen_lon_d01 = get_wps_param_value(wps_file, 'ref_lon', 1, 'float')
+    wps = read_wps(wps_file)
     
-    center_lat_full = np.zeros((ndomain, 1))
-    center_lon_full = np.zeros((ndomain, 1))
-    half_size_ns_full = np.zeros((ndomain, 1))
-    half_size_we_full = np.zeros((ndomain, 1))
-    corner_lat_full = np.zeros((ndomain, 4)) # ll, lr, uf, ur
-    corner_lon_full = np.zeros((ndomain, 4)) # ll, lr, uf, ur
-    dx_full = np.zeros((ndomain, 1))
-    dy_full = np.zeros((ndomain, 1))
-    length_x = np.zeros((ndomain, 1))
-    length_y = np.zeros((ndomain, 1))
-       
     # get WPS projection info
     # LCC
-    if proj_name=='lambert':
-        wpsproj = get_proj_lcc(wps_file)
+    if wps.map_proj=='lambert':
+        wpsproj = get_proj_lcc(wps)
+    else:
+        raise ValueError(f'map_proj {wps.map_proj} is not supported')
     
     # Geodetic, for lat/lon projection
     latlonproj = ccrs.Geodetic()
-    
-    # d01
-    dx_full[0] = dx_d01
-    dy_full[0] = dy_d01
-    center_lat_full[0] = cen_lat_d01
-    center_lon_full[0] = cen_lon_d01
-    length_x[0] = dx_full[0]*e_we_array[0]
-    length_y[0] = dy_full[0]*e_ns_array[0]
-    if ndomain>1:
-        e_we = int(e_we_array[0])
-        e_ns = int(e_ns_array[0])
-    else:
-        e_we = e_we_array
-        e_ns = e_ns_array
-    corner_lon_full[0,0], corner_lat_full[0,0] = calc_corner_point_latlon(float(center_lat_full[0]), float(center_lon_full[0]),
-                                                                          e_we, e_ns, 
-                                                                          float(dx_full[0]), float(dy_full[0]),
-                                                                          wpsproj, latlonproj, 'll')
-    corner_lon_full[0,1], corner_lat_full[0,1] = calc_corner_point_latlon(center_lat_full[0], center_lon_full[0],
-                                                                          e_we, e_ns,
-                                                                          dx_full[0], dy_full[0],
-                                                                          wpsproj, latlonproj, 'lr')
-    corner_lon_full[0,2], corner_lat_full[0,2] = calc_corner_point_latlon(center_lat_full[0], center_lon_full[0],
-                                                                          e_we, e_ns,
-                                                                          dx_full[0], dy_full[0],
-                                                                          wpsproj, latlonproj, 'ul')
-    corner_lon_full[0,3], corner_lat_full[0,3] = calc_corner_point_latlon(center_lat_full[0], center_lon_full[0],
-                                                                          e_we, e_ns, 
-                                                                          dx_full[0], dy_full[0],
-                                                                          wpsproj, latlonproj, 'ur')
-    
-    if ndomain>1:
-        for i in np.arange(1,ndomain):
-            dx_full[i] = dx_full[i-1]/float(grid_ratios[i])
-            dy_full[i] = dy_full[i-1]/float(grid_ratios[i])
-            length_x[i] = dx_full[i]*e_we_array[i]
-            length_y[i] = dy_full[i]*e_ns_array[i]
-            center_lon_full[i], center_lat_full[i] = calc_center_point_latlon(corner_lat_full[i-1,0], corner_lon_full[i-1,0],
-                                                                              dx_full[i-1], dy_full[i-1],
-                                                                              e_we_array[i], e_ns_array[i],
-                                                                              dx_full[i], dy_full[i],
-                                                                              i_parent_start_array[i], j_parent_start_array[i],
-                                                                              wpsproj, latlonproj)
-            corner_lon_full[i,0], corner_lat_full[i,0] = calc_corner_point_latlon(center_lat_full[i], center_lon_full[i],
-                                                                              e_we_array[i], e_ns_array[i], 
-                                                                              dx_full[i], dy_full[i],
-                                                                              wpsproj, latlonproj, 'll')
-            corner_lon_full[i,1], corner_lat_full[i,1] = calc_corner_point_latlon(center_lat_full[i], center_lon_full[i],
-                                                                              e_we_array[i], e_ns_array[i], 
-                                                                              dx_full[i], dy_full[i],
-                                                                              wpsproj, latlonproj, 'lr')
-            corner_lon_full[i,2], corner_lat_full[i,2] = calc_corner_point_latlon(center_lat_full[i], center_lon_full[i],
-                                                                              e_we_array[i], e_ns_array[i], 
-                                                                              dx_full[i], dy_full[i],
-                                                                              wpsproj, latlonproj, 'ul')
-            corner_lon_full[i,3], corner_lat_full[i,3] = calc_corner_point_latlon(center_lat_full[i], center_lon_full[i],
-                                                                              e_we_array[i], e_ns_array[i], 
-                                                                              dx_full[i], dy_full[i],
-                                                                              wpsproj, latlonproj, 'ur')
+
+    # all corners of all domains (ll, lr, ul, ur) in one projection call
+    center_x, center_y, _, _ = calc_domain_xy(wps, wpsproj)
+    half_x = (wps.dx*wps.e_we/2.0)[:, None]
+    half_y = (wps.dy*wps.e_sn/2.0)[:, None]
+    signs = np.array([corner_signs[loc] for loc in ['ll', 'lr', 'ul', 'ur']])
+    corner_x = center_x[:, None] + signs[:, 0]*half_x
+    corner_y = center_y[:, None] + signs[:, 1]*half_y
+    corner_lon_full, corner_lat_full = transform_xy(corner_x, corner_y, latlonproj, wpsproj)
+
+    length_x = (wps.dx*wps.e_we)[:, None]
+    length_y = (wps.dy*wps.e_sn)[:, None]
     
     return wpsproj, latlonproj, corner_lat_full, corner_lon_full, length_x, length_y
 
 def reproject_corners(corner_lons, corner_lats, wpsproj, latlonproj):
-    corner_x = np.zeros((4,1))
-    corner_y = np.zeros((4,1))
-    corner_x[0], corner_y[0] = wpsproj.transform_point(corner_lons[0], corner_lats[0], latlonproj)
-    corner_x[1], corner_y[1] = wpsproj.transform_point(corner_lons[1], corner_lats[1], latlonproj)
-    corner_x[2], corner_y[2] = wpsproj.transform_point(corner_lons[2], corner_lats[2], latlonproj)
-    corner_x[3], corner_y[3] = wpsproj.transform_point(corner_lons[3], corner_lats[3], latlonproj)
+    """
+    Corners of any shape, e.g. (ndomain, 4), projected in one call.
+    The four corners of one domain give (4, 1) arrays as before.
+    """
+    corner_x, corner_y = transform_xy(corner_lons, corner_lats, wpsproj, latlonproj)
+    if corner_x.ndim == 1:
+        corner_x, corner_y = corner_x[:, None], corner_y[:, None]
 
     return corner_x, corner_y
 
+# ===========================================================
+# Analytic 2-D grids of every domain from the namelist alone,
+# on the WRF sphere (r = 6370 km) with stand_lon as central meridian
+# ===========================================================
+
+wrf_earth_radius = 6370000.0
+
+def get_wrf_proj(wps_file):
+    """
+    The Lambert projection WRF itself uses: unlike get_proj_lcc (kept for
+    the domain maps) it is centred on stand_lon and uses the WRF sphere,
+    which is needed to reproduce the model grid exactly
+    """
+    wps = read_wps(wps_file)
+    if wps.map_proj != 'lambert':
+        raise ValueError(f'map_proj {wps.map_proj} is not supported')
+    globe = ccrs.Globe(ellipse='sphere', semimajor_axis=wrf_earth_radius,
+                       semiminor_axis=wrf_earth_radius)
+    return ccrs.LambertConformal(central_longitude=wps.stand_lon, central_latitude=wps.ref_lat,
+                                 standard_parallels=(wps.truelat1, wps.truelat2), globe=globe)
+
+def calc_domain_origin(wps_file, wrfproj=None):
+    """
+    Projected (x, y) of the lower-left staggered corner of every domain.
+    d01 is centred on ref_lat/ref_lon with (e_we-1)*dx cells; a nest starts
+    at staggered point (i_parent_start, j_parent_start) of its parent.
+    """
+    wps = read_wps(wps_file)
+    if wrfproj is None:
+        wrfproj = get_wrf_proj(wps)
+    ll_x = np.zeros(wps.max_dom)
+    ll_y = np.zeros(wps.max_dom)
+    center_x, center_y = wrfproj.transform_point(wps.ref_lon, wps.ref_lat, ccrs.Geodetic(wrfproj.globe))
+    ll_x[0] = center_x - wps.dx[0]*(wps.e_we[0]-1)/2.0
+    ll_y[0] = center_y - wps.dy[0]*(wps.e_sn[0]-1)/2.0
+    for i in range(1, wps.max_dom):
+        p = wps.parent_index[i]
+        ll_x[i] = ll_x[p] + wps.dx[p]*(wps.i_parent_start[i]-1)
+        ll_y[i] = ll_y[p] + wps.dy[p]*(wps.j_parent_start[i]-1)
+    return ll_x, ll_y
+
+def calc_domain_grid(wps_file, domain):
+    """
+    2-D lat/lon of the cell centres (e_sn-1, e_we-1) and cell corners
+    (e_sn, e_we) of a domain (1 for d01), computed once per namelist.
+
+    Returns lat, lon, lat_corner, lon_corner
+    """
+    wps = read_wps(wps_file)
+    if domain not in wps.grids:
+        if not 1 <= domain <= wps.max_dom:
+            raise ValueError(f'domain {domain} not in 1..{wps.max_dom}')
+        i = domain - 1
+        wrfproj = get_wrf_proj(wps)
+        latlonproj = ccrs.Geodetic(wrfproj.globe)
+        ll_x, ll_y = calc_domain_origin(wps, wrfproj)
+
+        x_corner = ll_x[i] + wps.dx[i]*np.arange(wps.e_we[i])
+        y_corner = ll_y[i] + wps.dy[i]*np.arange(wps.e_sn[i])
+        x_center = (x_corner[:-1] + x_corner[1:])/2.0
+        y_center = (y_corner[:-1] + y_corner[1:])/2.0
+
+        lon, lat = transform_xy(*np.meshgrid(x_center, y_center), latlonproj, wrfproj)
+        lon_corner, lat_corner = transform_xy(*np.meshgrid(x_corner, y_corner), latlonproj, wrfproj)
+        wps.grids[domain] = (lat, lon, lat_corner, lon_corner)
+    return wps.grids[domain]
+
+def validate_domain_grid(wps_file, domain, gridfile, tolerance=1e-3):
+    """
+    Compare the analytic cell centres with LAT/LON of GRIDCRO2D. MCIP trims
+    the boundary, so GRIDCRO2D is located in the domain by its first cell.
+    Returns dict(offset=(row, col), lat_error, lon_error, valid), errors in degrees
+    """
+    lat, lon, _, _ = calc_domain_grid(wps_file, domain)
+    with xr.open_dataset(gridfile) as grid:
+        grid_lat = grid.LAT[0,0,:,:].values
+        grid_lon = grid.LON[0,0,:,:].values
+
+    distance = (lat - grid_lat[0,0])**2 + (lon - grid_lon[0,0])**2
+    row, col = np.unravel_index(np.argmin(distance), lat.shape)
+    nrow, ncol = grid_lat.shape
+    if row + nrow > lat.shape[0] or col + ncol > lat.shape[1]:
+        raise ValueError(f'{gridfile} ({nrow}x{ncol}) does not fit in domain {domain} at ({row}, {col})')
+
+    lat_error = float(np.abs(lat[row:row+nrow, col:col+ncol] - grid_lat).max())
+    lon_error = float(np.abs(lon[row:row+nrow, col:col+ncol] - grid_lon).max())
+    valid = max(lat_error, lon_error) <= tolerance
+    print(f'd{domain:02d} offset ({row}, {col}), max error lat {lat_error:.2e} lon {lon_error:.2e}'
+          f' --> {"OK" if valid else "MISMATCH"}')
+    return dict(offset=(int(row), int(col)), lat_error=lat_error, lon_error=lon_error, valid=valid)
+
 # all these functions below are necessary only when LCC projection is used.
 def find_side(ls, side):
     """
@@ -217,31 +400,54 @@ def lambert_yticks_right(ax, ticks, size):
     ax.set_yticks(yticks)
     ax.set_yticklabels([ax.yaxis.get_major_formatter()(ytick) for ytick in yticklabels], size=size)
 
+# (projection, outline bounds, ticks, side) --> (tick positions, labels)
+_tick_cache = {}
+
+def _outline_bounds(ax):
+    outline = getattr(ax, 'outline_patch', None) or ax.spines['geo']
+    vertices = outline.get_path().vertices
+    return tuple(np.round(np.concatenate([vertices.min(axis=0), vertices.max(axis=0)]), 6))
+
 def _lambert_ticks(ax, ticks, tick_location, line_constructor, tick_extractor):
-    """Get the tick locations and labels for an axis of a Lambert Conformal projection."""
-    outline_patch = sgeom.LineString(ax.outline_patch.get_path().vertices.tolist())
-    axis = find_side(outline_patch, tick_location)
-    n_steps = 30
-    extent = ax.get_extent(ccrs.PlateCarree())
-    _ticks = []
-    for t in ticks:
-        xy = line_constructor(t, n_steps, extent)
-        proj_xyz = ax.projection.transform_points(ccrs.Geodetic(), xy[:, 0], xy[:, 1])
-        xyt = proj_xyz[..., :2]
-        ls = sgeom.LineString(xyt.tolist())
-        locs = axis.intersection(ls)
-        if not locs:
-            tick = [None]
+    """
+    Get the tick locations and labels for an axis of a Lambert Conformal projection.
+
+    All tick lines are projected in one call and crossed with the (straight)
+    side of the outline with numpy; results are memoized per projection,
+    outline and ticks, so panels sharing a map reuse them.
+    """
+    minx, miny, maxx, maxy = bounds = _outline_bounds(ax)
+    key = (ax.projection, bounds, tuple(ticks), tick_location)
+    if key not in _tick_cache:
+        n_steps = 30
+        extent = ax.get_extent(ccrs.PlateCarree())
+        xy = np.stack([line_constructor(t, n_steps, extent) for t in ticks])
+        proj_x, proj_y = transform_xy(xy[..., 0], xy[..., 1], ax.projection, ccrs.Geodetic())
+
+        # cross: coordinate normal to the side, along: coordinate along it
+        if tick_location == 'bottom':
+            cross, along, level, lo, hi = proj_y, proj_x, miny, minx, maxx
+        elif tick_location == 'top':
+            cross, along, level, lo, hi = proj_y, proj_x, maxy, minx, maxx
+        elif tick_location == 'left':
+            cross, along, level, lo, hi = proj_x, proj_y, minx, miny, maxy
         else:
-            tick = tick_extractor(locs.xy)
-        _ticks.append(tick[0])
-    # Remove ticks that aren't visible:    
-    ticklabels = copy(ticks)
-    while True:
-        try:
-            index = _ticks.index(None)
-        except ValueError:
-            break
-        _ticks.pop(index)
-        ticklabels.pop(index)
-    return _ticks, ticklabels
\ No newline at end of file
+            cross, along, level, lo, hi = proj_x, proj_y, maxx, miny, maxy
+
+        d0, d1 = cross[:, :-1] - level, cross[:, 1:] - level
+        a0, a1 = along[:, :-1], along[:, 1:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.where(d0 == d1, 0.0, d0/(d0 - d1))
+        loc = a0 + t*(a1 - a0)
+        hit = (d0*d1 <= 0) & np.isfinite(loc) & (loc >= lo) & (loc <= hi)
+
+        _ticks, ticklabels = [], []
+        for k, tick in enumerate(ticks):
+            # first crossing along the tick line; ticks that aren't visible are dropped
+            index = np.flatnonzero(hit[k])
+            if index.size:
+                _ticks.append(float(loc[k, index[0]]))
+                ticklabels.append(tick)
+        _tick_cache[key] = (_ticks, ticklabels)
+    _ticks, ticklabels = _tick_cache[key]
+    return list(_ticks), copy(ticklabels)
@@ -0,0 +1,30 @@
+import importlib
+
+# ===========================================================
+# The submodules are imported on first access (src.spatial, ...),
+# so `import src` does not pull in any of the heavy dependencies
+# ===========================================================
+
+__all__ = [
+    'namelist',
+    'catalog',
+    'mask',
+    'findpoint',
+    'spatial',
+    'WRFDomainLib',
+    'ModelEvalLib',
+    'nc_to_excel',
+    'obs_ingest',
+    'obs_store',
+    'obs_qc',
+    'runlog',
+    'RandomForest',
+]
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,43 @@
+import importlib
+import types
+
+# ===========================================================
+# Lazy imports: the heavy dependencies (pandas, xarray, matplotlib,
+# cartopy, cnmaps, geopandas, shapely, sklearn) are imported on first
+# attribute access, so importing a module of this package costs almost
+# nothing
+# ===========================================================
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access.
+    on_load(module) runs once right after the import.
+    """
+    def __init__(self, name, on_load=None):
+        super().__init__(name)
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_on_load'] = on_load
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_lazy_name'])
+            self.__dict__['_lazy_module'] = module
+            on_load = self.__dict__['_lazy_on_load']
+            if on_load is not None:
+                on_load(module)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_lazy_name']}' ({state})>"
+
+def lazy_import(name, on_load=None):
+    return LazyModule(name, on_load)
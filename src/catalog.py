@@ -0,0 +1,229 @@
+import os
+import re
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+
+if __package__:
+    from ._lazy import lazy_import
+    from .namelist import *
+else:
+    from _lazy import lazy_import
+    from namelist import *
+
+pd = lazy_import('pandas')
+xr = lazy_import('xarray')
+
+# ===========================================================
+# Catalog of the processed files:
+#   {processed_dir}/{case folder}/{month}_{year}_{kind}.nc
+# the folder is {month}_{year} for the base case and {case}_{year}
+# for the other cases (see preprocess). Every (case, month, year, kind,
+# variable) is indexed with its shape and time range, and datasets are
+# handed out from an LRU pool of open handles.
+#
+# Example:
+#
+# with use_dataset(2019, 'Sep', 'chem') as chem:
+#     ...
+# find(variable='O3', month='Sep')
+# ===========================================================
+
+# json file keeping the metadata between sessions, None: not written
+catalog_file = None
+max_open = 8
+
+_filename = re.compile(r'^(?P<month>[A-Za-z]{3})_(?P<year>\d{4})_(?P<kind>\w+)\.nc$')
+
+_catalog = {}
+
+def _case_name(folder, month, year):
+    case = folder[:-len(f'_{year}')] if folder.endswith(f'_{year}') else folder
+    return 'base' if case == month else case
+
+def read_metadata(path):
+    """
+    Shape and time range of every variable of one file (header only)
+    """
+    records = []
+    with xr.open_dataset(path) as ds:
+        if 'time' in ds.dims:
+            times = pd.DatetimeIndex(ds.time.values)
+            start, end, ntime = times[0].isoformat(), times[-1].isoformat(), len(times)
+        else:
+            start, end, ntime = None, None, 0
+        for var in ds.data_vars:
+            records.append(dict(
+                variable=var,
+                dims=list(ds[var].dims),
+                shape=[int(n) for n in ds[var].shape],
+                ntime=ntime, start=start, end=end,
+            ))
+    return records
+
+def scan_catalog(rootdir=None, refresh=False, indexfile=None):
+    """
+    Index of all processed files under rootdir as DataFrame, one row per
+    variable: case, month, year, kind, variable, path, dims, shape, ntime,
+    start, end.
+
+    The index is scanned once per session unless refresh. If indexfile (or
+    the module-level catalog_file) is set, the metadata is kept there and
+    only new or changed files (size, mtime) are opened again.
+    """
+    if rootdir is None:
+        rootdir = processed_dir
+    if indexfile is None:
+        indexfile = catalog_file
+    if rootdir in _catalog and not refresh:
+        return _catalog[rootdir]
+
+    cached = {}
+    if indexfile is not None and os.path.exists(indexfile):
+        with open(indexfile, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+
+    files = {}
+    rows = []
+    for folder in sorted(os.listdir(rootdir)):
+        if not os.path.isdir(os.path.join(rootdir, folder)):
+            continue
+        for filename in sorted(os.listdir(os.path.join(rootdir, folder))):
+            match = _filename.match(filename)
+            if match is None:
+                continue
+            relpath = folder + '/' + filename
+            stat = os.stat(os.path.join(rootdir, relpath))
+            record = cached.get(relpath)
+            if record is None or record['stat'] != [stat.st_size, stat.st_mtime]:
+                record = dict(stat=[stat.st_size, stat.st_mtime],
+                              variables=read_metadata(os.path.join(rootdir, relpath)))
+            files[relpath] = record
+
+            month, year, kind = match['month'], int(match['year']), match['kind']
+            for meta in record['variables']:
+                rows.append(dict(case=_case_name(folder, month, year), month=month,
+                                 year=year, kind=kind, path=os.path.join(rootdir, relpath),
+                                 **meta))
+
+    if indexfile is not None:
+        with open(indexfile + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(files, file, ensure_ascii=False, indent=0)
+        os.replace(indexfile + '.tmp', indexfile)
+
+    columns = ['case','month','year','kind','variable','path','dims','shape','ntime','start','end']
+    _catalog[rootdir] = pd.DataFrame(rows, columns=columns)
+    return _catalog[rootdir]
+
+def find(case=None, month=None, year=None, kind=None, variable=None, rootdir=None):
+    """
+    Rows of the catalog matching all given keys (a key may be a list)
+    """
+    catalog = scan_catalog(rootdir)
+    selected = pd.Series(True, index=catalog.index)
+    for key, value in dict(case=case, month=month, year=year, kind=kind, variable=variable).items():
+        if value is not None:
+            values = value if isinstance(value, (list, tuple)) else [value]
+            selected &= catalog[key].isin(values)
+    return catalog[selected]
+
+def _lookup(rootdir, **keys):
+    """
+    Catalog rows matching keys; a miss rescans the directory once, for
+    files processed after the first scan
+    """
+    rows = find(rootdir=rootdir, **keys)
+    if rows.empty:
+        scan_catalog(rootdir, refresh=True)
+        rows = find(rootdir=rootdir, **keys)
+    return rows
+
+def get_path(year, month, kind, case='base', rootdir=None):
+    """
+    Path of one processed file, e.g. get_path(2019, 'Sep', 'chem').
+    The expected path is checked first, the catalog is only scanned for
+    files stored elsewhere.
+    """
+    if rootdir is None:
+        rootdir = processed_dir
+    folder = f'{month}_{year}' if case == 'base' else f'{case}_{year}'
+    path = os.path.join(rootdir, folder, f'{month}_{year}_{kind}.nc')
+    if os.path.exists(path):
+        return path
+    rows = _lookup(rootdir, case=case, month=month, year=int(year), kind=kind)
+    if rows.empty:
+        raise FileNotFoundError(f'No {kind} file for case {case}, {month} {year} in {rootdir}')
+    return rows['path'].iloc[0]
+
+def get_kind(variable, year, month, case='base', rootdir=None):
+    """
+    Kind of file (mcip, chem, ...) that holds a variable
+    """
+    rows = _lookup(rootdir, case=case, month=month, year=int(year), variable=variable)
+    if rows.empty:
+        raise KeyError(f'{variable} not found for case {case}, {month} {year}')
+    return rows['kind'].iloc[0]
+
+# ===========================================================
+# LRU pool of open datasets: a dataset is closed only when it is
+# among the least recently used and no caller holds it any more
+# ===========================================================
+
+_pool = OrderedDict()   # path --> [dataset, number of holders]
+
+def _evict():
+    for path in list(_pool):
+        if len(_pool) <= max_open:
+            break
+        ds, holders = _pool[path]
+        if holders == 0:
+            del _pool[path]
+            ds.close()
+
+def open_dataset(year, month, kind, case='base', rootdir=None):
+    """
+    Open dataset of a processed file from the pool. Repeated calls return
+    the same handle (decoded coordinates included). The caller holds it
+    until release(ds); use_dataset does both.
+    """
+    path = get_path(year, month, kind, case, rootdir)
+    if path not in _pool:
+        _pool[path] = [xr.open_dataset(path), 0]
+    _pool.move_to_end(path)
+    _pool[path][1] += 1
+    _evict()
+    return _pool[path][0]
+
+def release(ds):
+    """
+    Give back a dataset of open_dataset, it may be closed afterwards
+    """
+    for entry in _pool.values():
+        if entry[0] is ds:
+            entry[1] = max(entry[1] - 1, 0)
+            break
+    _evict()
+
+@contextmanager
+def use_dataset(year, month, kind, case='base', rootdir=None):
+    ds = open_dataset(year, month, kind, case, rootdir)
+    try:
+        yield ds
+    finally:
+        release(ds)
+
+def open_variable(variable, year, month, case='base', rootdir=None):
+    """
+    One variable as DataArray (loaded), from whichever file holds it
+    """
+    kind = get_kind(variable, year, month, case, rootdir)
+    with use_dataset(year, month, kind, case, rootdir) as ds:
+        return ds[variable].load()
+
+def close_all():
+    """
+    Close every pooled dataset, including the ones still held
+    """
+    while _pool:
+        _, (ds, _) = _pool.popitem(last=False)
+        ds.close()
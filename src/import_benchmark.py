@@ -0,0 +1,58 @@
+import os
+import sys
+import subprocess
+
+# ===========================================================
+# Import-time benchmark: every module is imported in a fresh
+# interpreter, which is what a process-pool worker pays at start-up.
+#
+#   python import_benchmark.py [module ...] [--repeat 5]
+# ===========================================================
+
+srcdir = os.path.dirname(os.path.abspath(__file__))
+
+modules = [
+    'namelist', 'catalog', 'mask', 'findpoint', 'spatial', 'WRFDomainLib', 'ModelEvalLib',
+    'nc_to_excel', 'obs_ingest', 'obs_store', 'obs_qc', 'runlog', 'RandomForest',
+]
+
+_timer = (
+    "import time; t0 = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - t0)"
+)
+
+def import_time(module, repeat=5):
+    """
+    Best-of-repeat wall time (s) of `import module` in a fresh interpreter,
+    or None if the import fails
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', _timer.format(module=module)],
+                                cwd=srcdir, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+def run_benchmark(modulelist=None, repeat=5):
+    if modulelist is None:
+        modulelist = modules
+    output = {}
+    for module in modulelist:
+        seconds = import_time(module, repeat)
+        output[module] = seconds
+        if seconds is None:
+            print(f'{module:<14s} import failed')
+        else:
+            print(f'{module:<14s} {seconds*1000:8.1f} ms')
+    return output
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = 5
+    if '--repeat' in args:
+        i = args.index('--repeat')
+        repeat = int(args[i+1])
+        del args[i:i+2]
+    run_benchmark(args or None, repeat)
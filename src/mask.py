@@ -1,7 +1,13 @@
 import numpy as np
-import xarray as xr
-import shapely.geometry as sgeom
-from shapely.prepared import prep
+
+if __package__:
+    from ._lazy import lazy_import
+else:
+    from _lazy import lazy_import
+
+xr = lazy_import('xarray')
+sgeom = lazy_import('shapely.geometry')
+shapely_prepared = lazy_import('shapely.prepared')
 
 # silence the warning note
 import warnings
@@ -28,7 +34,7 @@ def polygon_to_mask(polygon, x, y):
     mask = np.zeros(x.shape, dtype=bool)
 
     # if each point falls into a polygon, without boundaries
-    prepared = prep(polygon)
+    prepared = shapely_prepared.prep(polygon)
     for index in np.ndindex(x.shape):
         point = sgeom.Point(x[index], y[index])
         if prepared.contains(point):
@@ -1,9 +1,22 @@
+import hashlib
 import numpy as np
-import pandas as pd
-import xarray as xr
-import geopandas as gpd
-from mask import polygon_to_mask
-from namelist import *
+
+if __package__:
+    from ._lazy import lazy_import
+    from .mask import polygon_to_mask
+    from .catalog import use_dataset
+    from .obs_store import load_obs_store, get_city_obs
+    from .namelist import *
+else:
+    from _lazy import lazy_import
+    from mask import polygon_to_mask
+    from catalog import use_dataset
+    from obs_store import load_obs_store, get_city_obs
+    from namelist import *
+
+pd = lazy_import('pandas')
+xr = lazy_import('xarray')
+gpd = lazy_import('geopandas')
 
 # silence the warning note
 import warnings
@@ -45,29 +58,124 @@ def write_to_excel(year, month, level, region,
     
     dfout = pd.DataFrame(
         index=pd.date_range(
-            start=start_date, end=end_date, freq='H'
+            start=start_date, end=end_date, freq='h'
         )
     )
     
     print(f'Processing data in {month}, {year}')
     
-    mcip = xr.open_dataset(datadir + f'processed/{month}_{year}/{month}_{year}_mcip.nc')
-    chem = xr.open_dataset(datadir + f'processed/{month}_{year}/{month}_{year}_chem.nc')
+    with use_dataset(year, month, 'mcip') as mcip, use_dataset(year, month, 'chem') as chem:
+        shp = gpd.read_file(shp_files[f'{region}_adm'])
+        lon = chem.longitude
+        lat = chem.latitude
+        mask    = polygon_to_mask(shp.geometry[0], lon, lat)
+        mask_da = xr.DataArray(mask, dims=('y','x'))
+        
+        nc_to_df(mcip_varlist,mcip,level,mask_da,dfout)
+        nc_to_df(chem_varlist,chem,level,mask_da,dfout)
     
-    shp = gpd.read_file(shp_files[f'{region}_adm'])
-    lon = chem.longitude
-    lat = chem.latitude
-    mask    = polygon_to_mask(shp.geometry[0], lon, lat)
-    mask_da = xr.DataArray(mask, dims=('y','x'))
+    outputpath = datadir + f'Contribution/{case}/data/'
+    dfout.to_excel(outputpath + f'SIM_{region}_{month}_{year}.xlsx',index=True)
     
-    nc_to_df(mcip_varlist,mcip,level,mask_da,dfout)
-    nc_to_df(chem_varlist,chem,level,mask_da,dfout)
+    return None
+
+# ===========================================================
+# All regions, all variables in one pass
+# ===========================================================
+
+_region_masks = {}
+
+def get_region_masks(regions, lon, lat):
+    """
+    Build (and cache) the grid mask of every region, keyed by region name
+    and the grid coordinates
+    """
+    lon = np.ascontiguousarray(lon, dtype='float64')
+    lat = np.ascontiguousarray(lat, dtype='float64')
+    grid = hashlib.sha1(lon.tobytes() + lat.tobytes()).hexdigest()
+    masks = {}
+    for region in regions:
+        key = (region, lon.shape, grid)
+        if key not in _region_masks:
+            shp = gpd.read_file(shp_files[f'{region}_adm'])
+            _region_masks[key] = polygon_to_mask(shp.geometry[0], lon, lat)
+        masks[region] = _region_masks[key]
+    return masks
+
+def nc_to_regions(varlist, input_ds, level, masks):
+    """
+    Select the level once, stack all variables and reduce them to the
+    mean of every region at the same time.
+    
+    Returns a dict of {var: array(time, region)}, regions ordered as in masks
+    """
+    stacked = input_ds[varlist].sel(level=level,method='nearest').squeeze()
+    stacked = stacked.to_array(dim='variable').transpose('variable','time','y','x')
+    values = stacked.values
+    nvar, nt, ny, nx = values.shape
+    values = values.reshape(nvar*nt, ny*nx)
+    
+    # (pixel, region) weights, the region mean is a single matrix product
+    weights = np.stack([masks[region].reshape(ny*nx) for region in masks], axis=1)
+    weights = weights.astype(values.dtype)
+    valid = ~np.isnan(values)
+    sums = np.where(valid, values, 0) @ weights
+    counts = valid.astype(values.dtype) @ weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).reshape(nvar, nt, len(masks))
+    
+    output = {}
+    for i, var in enumerate(varlist):
+        if var == 'QV':
+            output[var] = means[i]*1000
+        else:
+            output[var] = means[i]
+    return output
+
+def write_regions_to_excel(year, month, level, regions,
+                           mcip_varlist, chem_varlist, case=None):
+    """
+    Same output as write_to_excel, but opens the mcip/chem files once and
+    writes SIM_{region}_{month}_{year}.xlsx for every region in one pass
+    """
+    if case is None:
+        case = 'Annually'
+    if regions is None:
+        regions = city_names
+    
+    index = pd.date_range(
+        start=get_STR(year,month), end=get_END(year,month), freq='h'
+    )
+    
+    print(f'Processing data in {month}, {year}')
+    
+    with use_dataset(year, month, 'mcip') as mcip, use_dataset(year, month, 'chem') as chem:
+        masks = get_region_masks(regions, chem.longitude.values, chem.latitude.values)
+        
+        output = nc_to_regions(mcip_varlist,mcip,level,masks)
+        output.update(nc_to_regions(chem_varlist,chem,level,masks))
     
     outputpath = datadir + f'Contribution/{case}/data/'
-    dfout.to_excel(outputpath + f'SIM_{region}_{month}_{year}.xlsx',index=True)
+    for i, region in enumerate(masks):
+        dfout = pd.DataFrame(index=index)
+        for var in mcip_varlist + chem_varlist:
+            dfout[var] = output[var][:,i]
+        dfout.to_excel(outputpath + f'SIM_{region}_{month}_{year}.xlsx',index=True)
+        print(f'Complete {region}')
     
     return None
 
+def write_all_to_excel(years, months, level, mcip_varlist, chem_varlist,
+                       regions=None, case=None):
+    """
+    Extract every (year, month) for all regions, each file is read once
+    """
+    for year in years:
+        for month in months:
+            write_regions_to_excel(year, month, level, regions,
+                                   mcip_varlist, chem_varlist, case=case)
+    return None
+
 def write_obs_to_excel(year, month, city, city_en, varlist,case=None):
     if case is None:
         case = 'Annually'
@@ -83,7 +191,7 @@ def write_obs_to_excel(year, month, city, city_en, varlist,case=None):
     
     dfout = pd.DataFrame(
         index=pd.date_range(
-            start=start_date, end=end_date, freq='H'
+            start=start_date, end=end_date, freq='h'
         )
     )
     print(f'Processing data in {month}, {year}')
@@ -104,4 +212,28 @@ def write_obs_to_excel(year, month, city, city_en, varlist,case=None):
     outputpath = datadir + f'Contribution/{case}/data/'
     dfout.to_excel(outputpath + f'OBS_{city_en}_{month}_{year}.xlsx',index=True)
 
-    return None
\ No newline at end of file
+    return None
+
+def write_obs_all_to_excel(years, months, city_list, city_list_en, varlist,
+                           case=None, store=None):
+    """
+    Same output as write_obs_to_excel for every city, year and month,
+    reading the observation store instead of the per-year excel tables
+    """
+    if case is None:
+        case = 'Annually'
+    if store is None:
+        store = load_obs_store()
+    
+    outputpath = datadir + f'Contribution/{case}/data/'
+    for year in years:
+        for month in months:
+            print(f'Processing data in {month}, {year}')
+            citymean = get_city_obs(year, month, varlist, store=store)
+            for city, city_en in zip(city_list, city_list_en):
+                dfout = pd.DataFrame(index=citymean.time.values)
+                for var in varlist:
+                    dfout[var] = citymean.sel(variable=var, city=city).values
+                dfout.to_excel(outputpath + f'OBS_{city_en}_{month}_{year}.xlsx',index=True)
+    
+    return None
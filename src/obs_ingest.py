@@ -0,0 +1,163 @@
+import os
+import json
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__:
+    from ._lazy import lazy_import
+    from .namelist import *
+else:
+    from _lazy import lazy_import
+    from namelist import *
+
+pd = lazy_import('pandas')
+
+# silence the warning note
+import warnings
+warnings.filterwarnings("ignore")
+
+# ===========================================================
+# Ingest of the raw station csv files (OBS/original_CHEM) into a
+# partitioned parquet store: {ingest_dir}/{kind}/{var}/{year}/part-*.parquet
+#   kind: 'city' for the 城市* folders, 'site' for the 站点* folders
+# ===========================================================
+
+raw_obs_dir = datadir + 'OBS/original_CHEM/'
+ingest_dir = obs_dir + 'ingest/'
+ingest_varlist = ['AQI','PM2.5','NO2','O3','O3_8h']
+
+folder_kinds = {'城市': 'city', '站点': 'site'}
+
+def list_raw_files(rawpath=None):
+    """
+    List all raw csv files as (kind, relative path)
+    """
+    if rawpath is None:
+        rawpath = raw_obs_dir
+    files = []
+    for foldername in sorted(os.listdir(rawpath)):
+        for prefix, kind in folder_kinds.items():
+            if foldername.startswith(prefix):
+                for filename in sorted(os.listdir(os.path.join(rawpath, foldername))):
+                    if filename.endswith('.csv'):
+                        files.append((kind, foldername + '/' + filename))
+    return files
+
+def read_manifest(storepath=None):
+    if storepath is None:
+        storepath = ingest_dir
+    manifest = os.path.join(storepath, 'manifest.json')
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def write_manifest(records, storepath=None):
+    if storepath is None:
+        storepath = ingest_dir
+    manifest = os.path.join(storepath, 'manifest.json')
+    with open(manifest + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(records, file, ensure_ascii=False, indent=0)
+    os.replace(manifest + '.tmp', manifest)
+
+def parse_raw_csv(filepath, varlist, columns=None):
+    """
+    Parse one raw csv file once and split it into all variables.
+    Returns {var: DataFrame(index=datetime, columns=stations)}
+    """
+    df = pd.read_csv(filepath)
+    df = df[df['type'].isin(varlist)]
+    if columns is not None:
+        df = df[['date','hour','type'] + [col for col in df.columns if col in columns]]
+    df.index = pd.to_datetime(df['date'].astype(str) + 'T' + df['hour'].astype(str).str.zfill(2))
+    df.index.name = 'datetime'
+
+    output = {}
+    for var, group in df.groupby('type'):
+        group = group.drop(columns=['date','hour','type']).astype('float32')
+        group.columns = group.columns.astype(str)
+        output[var] = group
+    return output
+
+def _parse_task(args):
+    filepath, varlist, columns = args
+    return parse_raw_csv(filepath, varlist, columns)
+
+def write_partitions(kind, var, df, storepath=None):
+    """
+    Append one parquet file per year to the store
+    """
+    if storepath is None:
+        storepath = ingest_dir
+    stamp = pd.Timestamp.now().strftime('%Y%m%d%H%M%S%f')
+    for year, part in df.groupby(df.index.year):
+        outdir = os.path.join(storepath, kind, var, str(year))
+        os.makedirs(outdir, exist_ok=True)
+        part.sort_index().to_parquet(os.path.join(outdir, f'part-{stamp}.parquet'))
+
+def ingest_raw_obs(varlist=None, rawpath=None, storepath=None,
+                   city_columns=None, site_columns=None, max_workers=None):
+    """
+    Parse every raw csv not yet ingested on a process pool (each file is
+    read once for all variables) and append the result to the store.
+
+    city_columns/site_columns (list, optional): stations to keep, e.g.
+    the 9 PRD cities and the site codes of sitelocation.xlsx.
+    """
+    if varlist is None:
+        varlist = ingest_varlist
+    if rawpath is None:
+        rawpath = raw_obs_dir
+    if storepath is None:
+        storepath = ingest_dir
+    os.makedirs(storepath, exist_ok=True)
+
+    manifest = read_manifest(storepath)
+    columns = {'city': city_columns, 'site': site_columns}
+
+    tasks = {'city': [], 'site': []}
+    records = {}
+    for kind, relpath in list_raw_files(rawpath):
+        filepath = os.path.join(rawpath, relpath)
+        stat = os.stat(filepath)
+        record = [stat.st_size, stat.st_mtime]
+        if manifest.get(relpath) != record:
+            tasks[kind].append(filepath)
+            records[relpath] = record
+    print(f"New files: {len(tasks['city'])} city, {len(tasks['site'])} site")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for kind in ['city', 'site']:
+            if not tasks[kind]:
+                continue
+            args = [(filepath, varlist, columns[kind]) for filepath in tasks[kind]]
+            chunksize = max(1, len(args) // (8*(max_workers or os.cpu_count() or 1)))
+            parsed = list(executor.map(_parse_task, args, chunksize=chunksize))
+            for var in varlist:
+                dfs = [result[var] for result in parsed if var in result]
+                if dfs:
+                    write_partitions(kind, var, pd.concat(dfs), storepath)
+                    print(f'Complete {kind} {var}')
+
+    manifest.update(records)
+    write_manifest(manifest, storepath)
+
+    return None
+
+def read_ingested(kind, var, years=None, storepath=None):
+    """
+    Read one variable from the store as a wide DataFrame (datetime, station).
+    Re-ingested hours keep the latest value.
+    """
+    if storepath is None:
+        storepath = ingest_dir
+    if years is None:
+        years = ['*']
+    files = []
+    for year in years:
+        files += sorted(glob.glob(os.path.join(storepath, kind, var, str(year), 'part-*.parquet')))
+    if not files:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_parquet(file) for file in files])
+    df = df[~df.index.duplicated(keep='last')]
+    return df.sort_index()
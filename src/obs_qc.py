@@ -0,0 +1,174 @@
+import numpy as np
+
+if __package__:
+    from ._lazy import lazy_import
+else:
+    from _lazy import lazy_import
+
+pd = lazy_import('pandas')
+xr = lazy_import('xarray')
+
+# silence the warning note
+import warnings
+warnings.filterwarnings("ignore")
+
+# ===========================================================
+# Quality control and gap filling of the observation store
+# (DataArray with dims (variable, site, time), see obs_store),
+# all sites and variables are processed at once along time
+# ===========================================================
+
+# flag values
+FLAG_OK      = 0
+FLAG_MISSING = 1
+FLAG_RANGE   = 2
+FLAG_SPIKE   = 3
+FLAG_FILLED  = 4
+
+# valid range of each variable, ug m-3 (AQI dimensionless)
+obs_ranges = {
+    'AQI'   : (0, 500),
+    'PM2.5' : (0, 1000),
+    'NO2'   : (0, 1000),
+    'O3'    : (0, 1200),
+    'O3_8h' : (0, 1200),
+}
+
+def check_range(obs, ranges=None):
+    """
+    Mask of values outside the valid range of their variable
+    """
+    if ranges is None:
+        ranges = obs_ranges
+    # obs.variable is the DataArray's own Variable, the coordinate is obs['variable']
+    variables = obs['variable']
+    vmin = xr.DataArray([ranges.get(var, (-np.inf, np.inf))[0] for var in variables.values],
+                        dims='variable', coords={'variable': variables})
+    vmax = xr.DataArray([ranges.get(var, (-np.inf, np.inf))[1] for var in variables.values],
+                        dims='variable', coords={'variable': variables})
+    return (obs < vmin) | (obs > vmax)
+
+def check_spike(obs, window=7, k=5.0, min_dev=20.0):
+    """
+    Mask of spikes: departures from the centred rolling median larger than
+    k times the rolling MAD (scaled to sigma) and larger than min_dev
+    """
+    rolling = dict(time=window, center=True, min_periods=window//2+1)
+    median = obs.rolling(**rolling).median()
+    deviation = abs(obs - median)
+    mad = deviation.rolling(**rolling).median() * 1.4826
+    return (deviation > k*mad) & (deviation > min_dev)
+
+def gap_length(valid):
+    """
+    For every missing point of a (..., time) bool array, the length of the
+    gap it belongs to and whether the gap is bounded by valid points on
+    both sides. Returns prev/next valid index, gap length and bounded mask.
+    """
+    nt = valid.shape[-1]
+    index = np.broadcast_to(np.arange(nt), valid.shape)
+    # index of the last valid point at or before t / first at or after t
+    prev = np.maximum.accumulate(np.where(valid, index, -1), axis=-1)
+    nxt = np.minimum.accumulate(np.where(valid, index, nt)[..., ::-1], axis=-1)[..., ::-1]
+    bounded = (prev >= 0) & (nxt < nt)
+    length = np.where(bounded, nxt - prev - 1, nt)
+    return prev, nxt, length, bounded
+
+# valid points a series needs for the interpolation methods of fill_gaps
+# (spline/polynomial are of order 3), 2 for the others
+min_points = {'spline': 4, 'polynomial': 4, 'cubic': 4, 'quadratic': 3}
+
+def fill_gaps(obs, max_gap=3, method='linear'):
+    """
+    Fill gaps of at most max_gap hours that have valid data on both sides,
+    so series edges are never extrapolated.
+
+    method: 'linear' (vectorized over all series) or any method of
+    xarray.DataArray.interpolate_na, e.g. 'spline' / 'pchip'; series with
+    fewer valid points than the method needs (min_points) are not filled.
+    Time must be the last dimension.
+    """
+    values = obs.values
+    valid = ~np.isnan(values)
+    prev, nxt, length, bounded = gap_length(valid)
+    fillable = ~valid & bounded & (length <= max_gap)
+
+    if method == 'linear':
+        prev_c = np.clip(prev, 0, None)
+        nxt_c = np.clip(nxt, None, values.shape[-1]-1)
+        y0 = np.take_along_axis(values, prev_c, axis=-1)
+        y1 = np.take_along_axis(values, nxt_c, axis=-1)
+        index = np.arange(values.shape[-1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = (index - prev_c) / (nxt_c - prev_c)
+        interp = y0 + (y1 - y0)*weight
+    else:
+        # only series with enough valid points for the method are
+        # interpolated, sparse series are left unfilled
+        kwargs = {'order': 3} if method in ('spline', 'polynomial') else {}
+        series = values.reshape(-1, values.shape[-1])
+        enough = valid.reshape(series.shape).sum(axis=-1) >= min_points.get(method, 2)
+        interp = np.full(series.shape, np.nan, dtype=series.dtype)
+        if enough.any():
+            subset = xr.DataArray(series[enough], dims=('series','time'),
+                                  coords={'time': obs['time'].values})
+            interp[enough] = subset.interpolate_na(dim='time', method=method, **kwargs).values
+        interp = interp.reshape(values.shape)
+
+    # a gap is only filled where the method gave a value
+    fillable &= ~np.isnan(interp)
+    filled = np.where(fillable, interp, values)
+    return obs.copy(data=filled), obs.copy(data=fillable)
+
+def completeness(obs, freq='1D', min_fraction=20/24):
+    """
+    Fraction of valid hours per period and the flag of complete periods
+    (default: at least 20 valid hours per day)
+    """
+    valid = obs.notnull()
+    fraction = valid.resample(time=freq).sum() / valid.resample(time=freq).count()
+    return fraction, fraction >= min_fraction
+
+def clean_obs(obs, ranges=None, spike_window=7, spike_k=5.0, spike_min_dev=20.0,
+              max_gap=3, method='linear', freq='1D', min_fraction=20/24):
+    """
+    Range/spike checks, gap filling and completeness for all series.
+
+    Returns xr.Dataset with
+      obs:      cleaned and gap-filled data
+      flag:     FLAG_* of every value; a filled value keeps the flag of
+                the check that rejected it, FLAG_FILLED only for missing data
+      filled:   True where the value was filled
+      fraction: fraction of valid hours (before filling) per period
+      complete: completeness flag per period
+    """
+    flag = xr.full_like(obs, FLAG_OK, dtype='int8')
+    flag = flag.where(obs.notnull(), FLAG_MISSING)
+
+    out_range = check_range(obs, ranges)
+    flag = flag.where(~out_range, FLAG_RANGE)
+    cleaned = obs.where(~out_range)
+
+    spike = check_spike(cleaned, spike_window, spike_k, spike_min_dev)
+    flag = flag.where(~spike, FLAG_SPIKE)
+    cleaned = cleaned.where(~spike)
+
+    fraction, complete = completeness(cleaned, freq, min_fraction)
+
+    cleaned, filled = fill_gaps(cleaned, max_gap, method)
+    flag = flag.where(~(filled & (flag == FLAG_MISSING)), FLAG_FILLED)
+
+    return xr.Dataset(
+        data_vars=dict(
+            obs=cleaned,
+            flag=flag.astype('int8'),
+            filled=filled,
+            fraction=fraction.rename({'time': 'period'}),
+            complete=complete.rename({'time': 'period'}),
+        ),
+        attrs=dict(
+            max_gap=max_gap,
+            method=method,
+            createtime=pd.Timestamp.now().strftime('%Y-%m-%d'),
+        ),
+    )
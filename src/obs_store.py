@@ -0,0 +1,144 @@
+import os
+import numpy as np
+
+if __package__:
+    from ._lazy import lazy_import
+    from .obs_ingest import read_ingested
+    from .namelist import *
+else:
+    from _lazy import lazy_import
+    from obs_ingest import read_ingested
+    from namelist import *
+
+pd = lazy_import('pandas')
+xr = lazy_import('xarray')
+
+# silence the warning note
+import warnings
+warnings.filterwarnings("ignore")
+
+# ===========================================================
+# Observation store: one (variable, site, time) cube for all sites,
+# with the site metadata (city, longitude, latitude) attached
+# ===========================================================
+
+obs_store_path = obs_dir + 'obs_store.nc'
+obs_varlist = ['AQI','PM2.5','NO2','O3','O3_8h']
+
+_obs_store = {}
+
+def read_sitelocation():
+    """
+    Read sitelocation.xlsx, indexed by site code
+    """
+    sitelocation = pd.read_excel(obs_dir + 'sitelocation.xlsx')
+    sitelocation['监测点编码'] = sitelocation['监测点编码'].astype(str)
+    return sitelocation.set_index('监测点编码')
+
+def build_obs_store(varlist=None, inputpath=None, outpath=None, from_ingest=False):
+    """
+    Build the observation store from the site_{var}.xlsx tables (or from
+    the parquet store of obs_ingest if from_ingest) and save it as a
+    compressed netcdf file.
+
+    The output DataArray has dims (variable, site, time), and the coords
+    city / longitude / latitude along site.
+    """
+    if varlist is None:
+        varlist = obs_varlist
+    if inputpath is None:
+        inputpath = obs_dir + 'allTime/'
+    if outpath is None:
+        outpath = obs_store_path
+
+    sitelocation = read_sitelocation()
+    sites = sitelocation.index.values
+
+    tables = {}
+    for var in varlist:
+        if from_ingest:
+            df = read_ingested('site', var)
+        else:
+            df = pd.read_excel(inputpath + f'site_{var}.xlsx', index_col=0)
+        df.columns = df.columns.astype(str)
+        df = df[~df.index.duplicated(keep='first')]
+        tables[var] = df.reindex(columns=sites)
+        print(f'Complete {var}')
+
+    times = tables[varlist[0]].index
+    for var in varlist[1:]:
+        times = times.union(tables[var].index)
+    times = pd.date_range(times.min(), times.max(), freq='h')
+
+    values = np.full((len(varlist), len(sites), len(times)), np.nan, dtype='float32')
+    for i, var in enumerate(varlist):
+        values[i] = tables[var].reindex(times).values.T
+
+    store = xr.DataArray(
+        values,
+        dims=('variable','site','time'),
+        coords=dict(
+            variable=varlist,
+            site=sites,
+            time=times,
+            city=('site',sitelocation['城市'].values.astype(str)),
+            longitude=('site',sitelocation['经度'].values.astype(float)),
+            latitude=('site',sitelocation['纬度'].values.astype(float)),
+        ),
+        name='obs',
+        attrs=dict(
+            createtime=pd.Timestamp.now().strftime('%Y-%m-%d'),
+        ),
+    )
+
+    compression = dict(zlib=True,complevel=5)
+    store.to_netcdf(outpath,encoding={'obs':compression})
+    _obs_store[outpath] = store
+
+    return store
+
+def load_obs_store(path=None):
+    """
+    Load the observation store into memory, built on first use.
+    Repeated calls return the same in-memory store.
+    """
+    if path is None:
+        path = obs_store_path
+    if path not in _obs_store:
+        if not os.path.exists(path):
+            return build_obs_store(outpath=path)
+        with xr.open_dataarray(path) as store:
+            _obs_store[path] = store.load()
+    return _obs_store[path]
+
+def select_obs(store, city=None, start=None, end=None, varlist=None):
+    """
+    Slice the store by city (str or list), period and variables
+    """
+    output = store
+    if varlist is not None:
+        output = output.sel(variable=varlist)
+    if city is not None:
+        output = output.where(output.city.isin(np.atleast_1d(city)), drop=True)
+    if start is not None or end is not None:
+        output = output.sel(time=slice(start, end))
+    return output
+
+def city_mean(store, cities=None, start=None, end=None, varlist=None):
+    """
+    Mean over the sites of each city, for all cities at once.
+    Returns DataArray with dims (variable, city, time)
+    """
+    output = select_obs(store, city=cities, start=start, end=end, varlist=varlist)
+    return output.groupby('city').mean(dim='site', skipna=True)
+
+def get_city_obs(year, month, varlist, store=None):
+    """
+    Hourly city means of a month as DataArray (variable, city, time),
+    reindexed to the full month like the selTime tables
+    """
+    if store is None:
+        store = load_obs_store()
+    index = pd.date_range(get_STR(year,month), get_END(year,month), freq='h')
+    output = city_mean(store, start=index[0], end=index[-1], varlist=varlist)
+    return output.reindex(time=index)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+from collections import deque, defaultdict
+
+if __package__:
+    from ._lazy import lazy_import
+else:
+    from _lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# ===========================================================
+# Throughput instrumentation for long per-pixel runs
+# ===========================================================
+
+class RunLog:
+    """
+    Measured progress of a run: per-stage time, pixels/second per worker
+    and an ETA from the rate of the last `window` updates.
+
+    Every update is appended to logfile as one json line.
+
+    Example:
+
+    log = RunLog(total=ny*nx, logfile='rf_run.log')
+    log.update(nx, stages={'fit': 12.1, 'predict': 0.4}, worker=pid, label=f'row {y}')
+    log.summary()
+    """
+    def __init__(self, total, logfile=None, window=20, done=0):
+        self.total = total
+        self.done = done
+        self.logfile = logfile
+        self.start = time.perf_counter()
+        self.recent = deque(maxlen=window)
+        self.recent.append((self.start, 0))
+        self.stages = defaultdict(float)
+        self.worker_pixels = defaultdict(int)
+        self.worker_seconds = defaultdict(float)
+        if logfile is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(logfile)), exist_ok=True)
+            self._write(dict(event='start', total=total, done=done,
+                             time=pd.Timestamp.now().isoformat()))
+
+    def _write(self, record):
+        with open(self.logfile, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+    def rate(self):
+        # pixels per second over the recent updates
+        (t0, n0), (t1, n1) = self.recent[0], self.recent[-1]
+        if t1 <= t0:
+            return float('nan')
+        return (n1 - n0) / (t1 - t0)
+
+    def eta(self):
+        rate = self.rate()
+        if not rate > 0:
+            return float('nan')
+        return (self.total - self.done) / rate
+
+    def update(self, npixels, stages=None, worker=None, label=''):
+        now = time.perf_counter()
+        self.done += npixels
+        ran = self.recent[-1][1] + npixels
+        self.recent.append((now, ran))
+        if stages is not None:
+            for stage, seconds in stages.items():
+                self.stages[stage] += seconds
+            if worker is not None:
+                self.worker_pixels[worker] += npixels
+                # 'write' happens in the main process, not in the worker
+                self.worker_seconds[worker] += sum(v for k, v in stages.items() if k != 'write')
+
+        rate, eta = self.rate(), self.eta()
+        print(f'{label} --> {self.done/self.total*100:.2f} %, '
+              f'{rate:.3f} pixel/s, ETA {eta/3600:.2f} h')
+        if self.logfile is not None:
+            self._write(dict(event='update', label=label, done=self.done,
+                             elapsed=now - self.start, rate=rate, eta=eta,
+                             worker=worker, stages=stages))
+
+    def summary(self):
+        """
+        Stage totals and per-worker throughput as DataFrames
+        """
+        elapsed = time.perf_counter() - self.start
+        stages = pd.Series(self.stages, name='seconds', dtype=float)
+        workers = pd.DataFrame({
+            'pixels': pd.Series(self.worker_pixels, dtype=float),
+            'seconds': pd.Series(self.worker_seconds, dtype=float),
+        })
+        # a worker without measured seconds has no rate (NaN)
+        seconds = workers['seconds'].where(workers['seconds'] > 0)
+        workers['pixels_per_second'] = workers['pixels'] / seconds
+        print(f'Elapsed {elapsed/3600:.2f} h, {self.done} of {self.total} pixels')
+        print(stages.to_string())
+        if not workers.empty:
+            print(workers.to_string(float_format='{:.3f}'.format))
+        if self.logfile is not None:
+            self._write(dict(event='end', elapsed=elapsed, done=self.done,
+                             stages=dict(self.stages),
+                             workers={str(k): dict(pixels=int(row['pixels']),
+                                                   seconds=row['seconds'],
+                                                   pixels_per_second=row['pixels_per_second'])
+                                      for k, row in workers.iterrows()}))
+        return stages, workers
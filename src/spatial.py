@@ -1,24 +1,236 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-from matplotlib.colors import Normalize
 
-from cnmaps import get_adm_maps, clip_quiver_by_map, clip_contours_by_map, draw_map
-import geopandas as gpd
-from shapely.ops import unary_union
+import os
+import pickle
+
+if __package__:
+    from ._lazy import lazy_import
+    from .namelist import datadir
+else:
+    from _lazy import lazy_import
+    from namelist import datadir
 
-from matplotlib import rcParams
 config = {
     "font.family":'Times New Roman',
     "mathtext.fontset":'stix',
     "font.serif": ['SimSun'],
 }
-rcParams.update(config)
+
+def _apply_config(pyplot):
+    pyplot.rcParams.update(config)
+
+# heavy dependencies are imported on first use, the font config is
+# applied when pyplot is loaded
+plt = lazy_import('matplotlib.pyplot', on_load=_apply_config)
+ccrs = lazy_import('cartopy.crs')
+cnmaps = lazy_import('cnmaps')
+gpd = lazy_import('geopandas')
+mcolors = lazy_import('matplotlib.colors')
+mpatches = lazy_import('matplotlib.patches')
+mpath = lazy_import('matplotlib.path')
+mcollections = lazy_import('matplotlib.collections')
+shapely_ops = lazy_import('shapely.ops')
+shapely_wkb = lazy_import('shapely.wkb')
 
 # silence the warning note
 import warnings
 warnings.filterwarnings("ignore")
 
+# =============================================
+# PRD boundary cache: city polygons, merged clip polygon
+# and its clip path for each projection
+# =============================================
+
+PRD_cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
+boundary_cachefile = datadir + 'shapefile/PRD_boundary.pkl'
+
+_boundary = {}
+_clip_paths = {}
+
+def get_PRD_boundary():
+    """
+    City polygons and their union, built once per session from cnmaps and
+    persisted to boundary_cachefile for the next sessions
+    """
+    if 'polygons' not in _boundary:
+        cached = None
+        if os.path.exists(boundary_cachefile):
+            with open(boundary_cachefile, 'rb') as file:
+                cached = pickle.load(file)
+        if cached is not None and cached['cities'] == PRD_cities:
+            polygons = [shapely_wkb.loads(polygon) for polygon in cached['polygons']]
+            map_polygon = shapely_wkb.loads(cached['map_polygon'])
+        else:
+            polygons = [cnmaps.get_adm_maps(city=city, record='first', only_polygon=True) for city in PRD_cities]
+            map_polygon = shapely_ops.unary_union(polygons)
+            os.makedirs(os.path.dirname(boundary_cachefile), exist_ok=True)
+            with open(boundary_cachefile, 'wb') as file:
+                pickle.dump(dict(cities=PRD_cities,
+                                 polygons=[shapely_wkb.dumps(polygon) for polygon in polygons],
+                                 map_polygon=shapely_wkb.dumps(map_polygon)), file)
+        _boundary['polygons'] = polygons
+        _boundary['map_polygon'] = map_polygon
+    return _boundary['polygons'], _boundary['map_polygon']
+
+def get_PRD_clip_path(projection):
+    """
+    The merged PRD polygon projected to the map projection, as a path
+    """
+    key = (type(projection).__name__, projection.proj4_init)
+    if key not in _clip_paths:
+        _, map_polygon = get_PRD_boundary()
+        geometry = projection.project_geometry(map_polygon, ccrs.PlateCarree())
+        try:
+            from cartopy.mpl.path import shapely_to_path
+            path = shapely_to_path(geometry)
+        except ImportError:
+            from cartopy.mpl.patch import geos_to_path
+            path = mpath.Path.make_compound_path(*geos_to_path(geometry))
+        _clip_paths[key] = path
+    return _clip_paths[key]
+
+def draw_PRD_boundary(ax, color='gray', linewidth=0.8):
+    polygons, _ = get_PRD_boundary()
+    ax.add_geometries(polygons, crs=ccrs.PlateCarree(),
+                      facecolor='none', edgecolor=color, linewidth=linewidth)
+
+def clip_by_PRD(artist, ax):
+    """
+    Clip contourf / quiver to the PRD boundary with the cached clip path
+    """
+    clip = mpatches.PathPatch(get_PRD_clip_path(ax.projection), transform=ax.transData)
+    # ContourSet is a single Collection since matplotlib 3.8
+    artists = [artist] if isinstance(artist, mcollections.Collection) else artist.collections
+    for item in artists:
+        item.set_clip_path(clip)
+
+
+# =============================================
+# Fast raster preview: pcolormesh masked by the PRD grid mask
+# =============================================
+
+preview_dpi = 72
+_grid_masks = {}
+
+def get_PRD_grid_mask(lon, lat):
+    """
+    Boolean mask of the grid cells inside the merged PRD polygon, cached per grid
+    """
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    key = (lon.shape, float(lon.flat[0]), float(lat.flat[0]), float(lon.flat[-1]), float(lat.flat[-1]))
+    if key not in _grid_masks:
+        if __package__:
+            from .mask import polygon_to_mask
+        else:
+            from mask import polygon_to_mask
+        _, map_polygon = get_PRD_boundary()
+        _grid_masks[key] = polygon_to_mask(map_polygon, lon, lat)
+    return _grid_masks[key]
+
+def preview_colormap(colormap, levels):
+    """
+    Colormap and norm giving a mesh the colours of contourf(levels=levels,
+    extend='both'): each layer takes the colour of its midpoint, values out
+    of the levels take the under/over colours, and the colorbar is extended
+    on both sides over the same boundaries.
+    """
+    cmap = plt.get_cmap(colormap)
+    levels = np.asarray(levels, dtype=float)
+    layers = mcolors.Normalize(levels[0], levels[-1])(0.5 * (levels[:-1] + levels[1:]))
+    colors = [cmap.get_under()] + list(cmap(layers)) + [cmap.get_over()]
+    return mcolors.from_levels_and_colors(levels, colors, extend='both')
+
+def draw_field(ax, lon, lat, data, colormap, levels, preview=False):
+    """
+    Filled field on the map, clipped to PRD. Final: contourf clipped by the
+    boundary path. Preview: raster mesh masked by the cached grid mask,
+    with the same colour levels.
+    """
+    if not preview:
+        cf = ax.contourf(lon, lat, data,
+                         cmap=colormap,
+                         levels=levels, extend='both',
+                         transform=ccrs.PlateCarree())
+        clip_by_PRD(cf, ax)
+        return cf
+
+    cmap, norm = preview_colormap(colormap, levels)
+    inside = get_PRD_grid_mask(lon, lat)
+    masked = np.ma.masked_where(~inside, np.asarray(data))
+    return ax.pcolormesh(lon, lat, masked, cmap=cmap, norm=norm,
+                         shading='auto', transform=ccrs.PlateCarree())
+
+# =============================================
+# Output: show and/or save, headless mode with background writers
+# =============================================
+
+headless = False
+_save_pool = None
+_save_workers = 0
+_pending_saves = []
+_previous_backend = None
+
+def set_headless(enable=True, writers=0):
+    """
+    Headless mode: figures are not shown, only saved and closed (Agg
+    backend). With writers > 0 the PNG/PDF encoding runs on a pool of
+    background threads, overlapping with the rendering of the next figure.
+    set_headless(False) switches back to the backend in use before.
+    """
+    global headless, _save_pool, _save_workers, _previous_backend
+    wait_saves()
+    if _save_pool is not None:
+        _save_pool.shutdown()
+        _save_pool = None
+        _save_workers = 0
+    if enable and _previous_backend is None:
+        _previous_backend = plt.get_backend()
+    elif not enable and _previous_backend is not None:
+        plt.switch_backend(_previous_backend)
+        _previous_backend = None
+    headless = enable
+    if enable:
+        plt.switch_backend('Agg')
+        if writers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            _save_pool = ThreadPoolExecutor(max_workers=writers)
+            _save_workers = writers
+
+def _save_figure(fig, outpath, dpi):
+    # outpath can be a list, e.g. ['map.png', 'map.pdf']
+    for path in np.atleast_1d(outpath):
+        fig.savefig(path, dpi=dpi, bbox_inches='tight')
+
+def wait_saves():
+    """
+    Block until all background saves are written
+    """
+    while _pending_saves:
+        _pending_saves.pop(0).result()
+
+def finish_figure(fig, outpath=None, show=None, dpi=300):
+    """
+    Show (default unless headless) and save the figure. A figure that is not
+    shown is closed, and saved on the background writers if enabled, with at
+    most 2 pending figures per writer kept in memory.
+    """
+    if show is None:
+        show = not headless
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+    if outpath is None:
+        return
+    if show or _save_pool is None:
+        _save_figure(fig, outpath, dpi)
+        return
+    while len(_pending_saves) >= 2*_save_workers:
+        _pending_saves.pop(0).result()
+    _pending_saves.append(_save_pool.submit(_save_figure, fig, outpath, dpi))
+
 # Change font size and two subplots
 # revised version of plot_map_withobs, 2024-05-01
 def contourmap(gridfile, cmin, cmax, cmstep, cbstep, 
@@ -27,14 +239,14 @@ def contourmap(gridfile, cmin, cmax, cmstep, cbstep,
                   obs1_to_plot, obs2_to_plot, 
                   obslon, obslat,ngrid=None, scale=None, headwidth=None,
                   mapcolor=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 2, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -45,16 +257,8 @@ def contourmap(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8,ax=ax[0])
-        draw_map(polygon, color='gray', linewidth=0.8,ax=ax[1])
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax[0])
+    draw_PRD_boundary(ax[1])
 
     data_to_plot = [data1_to_plot, data2_to_plot]
     for i in range(2):
@@ -74,12 +278,7 @@ def contourmap(gridfile, cmin, cmax, cmstep, cbstep,
         # Pollutants concentration & Mask map
         # =============================================
 
-        cf = ax[i].contourf(lon, lat, data_to_plot[i],
-                        cmap=colormap,
-                        levels=contourf_ticks, extend='both',
-                        transform=ccrs.PlateCarree())
-
-        clip_contours_by_map(cf,map_polygon,ax=ax[i])
+        cf = draw_field(ax[i], lon, lat, data_to_plot[i], colormap, contourf_ticks, preview)
         # =============================================
         # Wind vector map & Mask map
         # =============================================
@@ -92,14 +291,14 @@ def contourmap(gridfile, cmin, cmax, cmstep, cbstep,
             qv = ax[i].quiver(lon[0:ygrid:ngrid, 0:xgrid:ngrid], lat[0:ygrid:ngrid, 0:xgrid:ngrid],
                        uwind[i][0:ygrid:ngrid, 0:xgrid:ngrid], vwind[i][0:ygrid:ngrid, 0:xgrid:ngrid],
                        transform=ccrs.PlateCarree(), color='k', alpha=1, scale=scale, headwidth=headwidth)
-            clip_quiver_by_map(qv, map_polygon,ax=ax[i])
+            clip_by_PRD(qv, ax[i])
 
         # =============================================
         # Observation stations scatter & Mask map
         # =============================================
         
         obs_to_plot = [obs1_to_plot, obs2_to_plot]
-        norm = Normalize(vmin=cmin, vmax=cmax)
+        norm = mcolors.Normalize(vmin=cmin, vmax=cmax)
         
         cs = ax[i].scatter(obslon,obslat,c=obs_to_plot[i],cmap=colormap,marker='o',s=20,
                         edgecolors='k',linewidths=0.5,norm=norm,transform=ccrs.PlateCarree())
@@ -113,30 +312,27 @@ def contourmap(gridfile, cmin, cmax, cmstep, cbstep,
 
     fig.subplots_adjust(right=0.9)
     pos = fig.add_axes([0.92, 0.25, 0.02, 0.5])
-    cbar = fig.colorbar(cf,cax=pos,orientation='vertical')
+    cbar = fig.colorbar(cf,spacing='proportional',cax=pos,orientation='vertical')
     cbar.set_ticks(colorbar_ticks)
     cbar.ax.tick_params(labelsize=20)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label,fontsize=20)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
 
 def map_noneobs(gridfile, cmin, cmax, cmstep, cbstep, 
                   data1_to_plot, data2_to_plot,
                   uwind1,vwind1,uwind2,vwind2,
                   ngrid=None, scale=None, headwidth=None,
                   mapcolor=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 2, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -147,16 +343,8 @@ def map_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8,ax=ax[0])
-        draw_map(polygon, color='gray', linewidth=0.8,ax=ax[1])
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax[0])
+    draw_PRD_boundary(ax[1])
 
     data_to_plot = [data1_to_plot, data2_to_plot]
     for i in range(2):
@@ -176,12 +364,7 @@ def map_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
         # Pollutants concentration & Mask map
         # =============================================
 
-        cf = ax[i].contourf(lon, lat, data_to_plot[i],
-                        cmap=colormap,
-                        levels=contourf_ticks, extend='both',
-                        transform=ccrs.PlateCarree())
-
-        clip_contours_by_map(cf,map_polygon,ax=ax[i])
+        cf = draw_field(ax[i], lon, lat, data_to_plot[i], colormap, contourf_ticks, preview)
         # =============================================
         # Wind vector map & Mask map
         # =============================================
@@ -194,7 +377,7 @@ def map_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
             qv = ax[i].quiver(lon[0:ygrid:ngrid, 0:xgrid:ngrid], lat[0:ygrid:ngrid, 0:xgrid:ngrid],
                        uwind[i][0:ygrid:ngrid, 0:xgrid:ngrid], vwind[i][0:ygrid:ngrid, 0:xgrid:ngrid],
                        transform=ccrs.PlateCarree(), color='k', alpha=1, scale=scale, headwidth=headwidth)
-            clip_quiver_by_map(qv, map_polygon,ax=ax[i])
+            clip_by_PRD(qv, ax[i])
 
     # =============================================
     # Defining title of the map and colorbar
@@ -205,16 +388,13 @@ def map_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
 
     fig.subplots_adjust(right=0.9)
     pos = fig.add_axes([0.92, 0.25, 0.02, 0.5])
-    cbar = fig.colorbar(cf,cax=pos,orientation='vertical')
+    cbar = fig.colorbar(cf,spacing='proportional',cax=pos,orientation='vertical')
     cbar.set_ticks(colorbar_ticks)
     cbar.ax.tick_params(labelsize=20)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label,fontsize=20)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
 
 # Change font size
 # revised version of plot_map_withobs, 2024-05-01
@@ -223,14 +403,14 @@ def map_diff(gridfile, cmin, cmax, cmstep, cbstep,
                   obs1_to_plot, obs2_to_plot, 
                   obslon, obslat,
                   mapcolor=None, title=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -241,15 +421,7 @@ def map_diff(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -267,18 +439,13 @@ def map_diff(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data2_to_plot - data1_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data2_to_plot - data1_to_plot, colormap, contourf_ticks, preview)
     
     # =============================================
     # Observation stations scatter & Mask map
     # =============================================
     
-    norm = Normalize(vmin=cmin, vmax=cmax)
+    norm = mcolors.Normalize(vmin=cmin, vmax=cmax)
     
     cs = ax.scatter(obslon,obslat,c=obs2_to_plot - obs1_to_plot,cmap=colormap,marker='o',s=20,
                     edgecolors='k',linewidths=0.5,norm=norm,transform=ccrs.PlateCarree())
@@ -290,28 +457,25 @@ def map_diff(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 40, 'fontweight': 'bold'})
 
-    cbar = fig.colorbar(cf)
+    cbar = fig.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     cbar.ax.tick_params(labelsize=30)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label,fontsize=30)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
 
 def diff_noneobs(gridfile, cmin, cmax, cmstep, cbstep, 
                   data1_to_plot, data2_to_plot,
                   mapcolor=None, title=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -322,15 +486,7 @@ def diff_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -348,12 +504,7 @@ def diff_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data2_to_plot - data1_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data2_to_plot - data1_to_plot, colormap, contourf_ticks, preview)
 
     # =============================================
     # Defining title of the map and colorbar
@@ -362,16 +513,13 @@ def diff_noneobs(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 40, 'fontweight': 'bold'})
 
-    cbar = fig.colorbar(cf)
+    cbar = fig.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     cbar.ax.tick_params(labelsize=30)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label,fontsize=30)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
 
 #==================================================================
 
@@ -379,7 +527,7 @@ def plot_PRD_map(gridfile, cmin, cmax, cmstep, cbstep,
                  data_to_plot, uwind_to_plot, vwind_to_plot,
                  ngrid=None, scale=None, headwidth=None, 
                  mapcolor=None, title=None, colorbar_label=None,
-                 outpath = None):
+                 outpath=None, show=None, preview=False):
     
     '''
     绘制珠三角地区的填色地图，包括污染物浓度和风向风速。
@@ -398,33 +546,27 @@ def plot_PRD_map(gridfile, cmin, cmax, cmstep, cbstep,
     headwidth (float, optional)：风速箭头的头部宽度。
     title (str, optional)：地图的标题。
     colorbar_label (str, optional)：颜色条的标签。
+    show (bool, optional)：是否显示图片，默认非headless模式下显示。
+    preview (bool, optional)：快速栅格预览（低dpi、pcolormesh），最终出图时设为False。
     '''
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
     if mapcolor is not None:
         colormap = mapcolor
     else:
         colormap = 'Spectral_r'
     
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
 
     # =============================================
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -440,12 +582,7 @@ def plot_PRD_map(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data_to_plot, colormap, contourf_ticks, preview)
 
     # =============================================
     # Wind vector map & Mask map
@@ -457,7 +594,7 @@ def plot_PRD_map(gridfile, cmin, cmax, cmstep, cbstep,
         qv = ax.quiver(lon[0:ygrid:ngrid, 0:xgrid:ngrid], lat[0:ygrid:ngrid, 0:xgrid:ngrid],
                        uwind_to_plot[0:ygrid:ngrid, 0:xgrid:ngrid], vwind_to_plot[0:ygrid:ngrid, 0:xgrid:ngrid],
                        transform=ccrs.PlateCarree(), color='k', alpha=1, scale=scale, headwidth=headwidth)
-        clip_quiver_by_map(qv, map_polygon)
+        clip_by_PRD(qv, ax)
 
     # =============================================
     # Defining title of the map and colorbar
@@ -466,20 +603,17 @@ def plot_PRD_map(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 16, 'fontweight': 'bold'})
 
-    cbar = plt.colorbar(cf)
+    cbar = plt.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
 
 def plot_PRD_diff(gridfile, cmin, cmax, cmstep, cbstep, 
                   data1_to_plot, data2_to_plot,
                   mapcolor=None, title=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     '''
     绘制珠三角地区的污染物浓度差值填色图。
@@ -494,14 +628,16 @@ def plot_PRD_diff(gridfile, cmin, cmax, cmstep, cbstep,
     data2_to_plot (array-like)：污染物浓度数据2。
     title (str, optional)：地图的标题。
     colorbar_label (str, optional)：颜色条的标签。
+    show (bool, optional)：是否显示图片，默认非headless模式下显示。
+    preview (bool, optional)：快速栅格预览（低dpi、pcolormesh），最终出图时设为False。
     '''
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -512,15 +648,7 @@ def plot_PRD_diff(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -536,12 +664,7 @@ def plot_PRD_diff(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data2_to_plot - data1_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data2_to_plot - data1_to_plot, colormap, contourf_ticks, preview)
 
     # =============================================
     # Defining title of the map and colorbar
@@ -550,15 +673,12 @@ def plot_PRD_diff(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 16, 'fontweight': 'bold'})
 
-    cbar = plt.colorbar(cf)
+    cbar = plt.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
     
 
 def plot_map_withobs(gridfile, cmin, cmax, cmstep, cbstep, 
@@ -566,33 +686,25 @@ def plot_map_withobs(gridfile, cmin, cmax, cmstep, cbstep,
                  obsdata, obslon, obslat,
                  ngrid=None, scale=None, headwidth=None, 
                  mapcolor=None, title=None, colorbar_label=None,
-                 outpath=None):
+                 outpath=None, show=None, preview=False):
 
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
     if mapcolor is not None:
         colormap = mapcolor
     else:
         colormap = 'Spectral_r'
     
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
 
     # =============================================
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -608,12 +720,7 @@ def plot_map_withobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data_to_plot, colormap, contourf_ticks, preview)
 
     # =============================================
     # Wind vector map & Mask map
@@ -625,13 +732,13 @@ def plot_map_withobs(gridfile, cmin, cmax, cmstep, cbstep,
         qv = ax.quiver(lon[0:ygrid:ngrid, 0:xgrid:ngrid], lat[0:ygrid:ngrid, 0:xgrid:ngrid],
                        uwind_to_plot[0:ygrid:ngrid, 0:xgrid:ngrid], vwind_to_plot[0:ygrid:ngrid, 0:xgrid:ngrid],
                        transform=ccrs.PlateCarree(), color='k', alpha=1, scale=scale, headwidth=headwidth)
-        clip_quiver_by_map(qv, map_polygon)
+        clip_by_PRD(qv, ax)
 
     # =============================================
     # Observation stations scatter & Mask map
     # =============================================
     
-    norm = Normalize(vmin=cmin, vmax=cmax)
+    norm = mcolors.Normalize(vmin=cmin, vmax=cmax)
     
     cs = ax.scatter(obslon,obslat,c=obsdata,cmap=colormap,marker='o',s=20,
                     edgecolors='k',linewidths=0.5,norm=norm,transform=ccrs.PlateCarree())
@@ -643,15 +750,12 @@ def plot_map_withobs(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 16, 'fontweight': 'bold'})
 
-    cbar = plt.colorbar(cf)
+    cbar = plt.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
     
 
 def plot_diff_withobs(gridfile, cmin, cmax, cmstep, cbstep, 
@@ -659,14 +763,14 @@ def plot_diff_withobs(gridfile, cmin, cmax, cmstep, cbstep,
                   obs1_to_plot, obs2_to_plot, 
                   obslon, obslat,
                   mapcolor=None, title=None, colorbar_label=None,
-                  outpath=None):
+                  outpath=None, show=None, preview=False):
     
     lon = gridfile.longitude
     lat = gridfile.latitude
-    contourf_ticks = np.arange(cmin, cmax, cmstep)
+    contourf_ticks = np.arange(cmin, cmax+cmstep/2, cmstep)
     colorbar_ticks = np.arange(cmin,cmax+0.01,cbstep)
 
-    fig = plt.figure(figsize=(12, 6), dpi=300)
+    fig = plt.figure(figsize=(12, 6), dpi=preview_dpi if preview else 300)
     ax = fig.subplots(1, 1, subplot_kw={'projection': ccrs.PlateCarree()})
     if mapcolor is not None:
         colormap = mapcolor
@@ -677,15 +781,7 @@ def plot_diff_withobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Defining map boundaries
     # =============================================
     
-    cities = ['广州市', '佛山市', '深圳市', '东莞市', '珠海市', '中山市', '惠州市', '江门市', '肇庆市']
-    multi_polygons = []
-
-    for city in cities:
-        polygon = get_adm_maps(city=city, record='first', only_polygon=True)
-        multi_polygons.append(polygon)
-        draw_map(polygon, color='gray', linewidth=0.8)
-
-    map_polygon = unary_union(multi_polygons)
+    draw_PRD_boundary(ax)
 
     gl = ax.gridlines(
         xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
@@ -701,18 +797,13 @@ def plot_diff_withobs(gridfile, cmin, cmax, cmstep, cbstep,
     # Pollutants concentration & Mask map
     # =============================================
 
-    cf = ax.contourf(lon, lat, data2_to_plot - data1_to_plot,
-                     cmap=colormap,
-                     levels=contourf_ticks, extend='both',
-                     transform=ccrs.PlateCarree())
-
-    clip_contours_by_map(cf, map_polygon)
+    cf = draw_field(ax, lon, lat, data2_to_plot - data1_to_plot, colormap, contourf_ticks, preview)
     
     # =============================================
     # Observation stations scatter & Mask map
     # =============================================
     
-    norm = Normalize(vmin=cmin, vmax=cmax)
+    norm = mcolors.Normalize(vmin=cmin, vmax=cmax)
     
     cs = ax.scatter(obslon,obslat,c=obs2_to_plot - obs1_to_plot,cmap=colormap,marker='o',s=20,
                     edgecolors='k',linewidths=0.5,norm=norm,transform=ccrs.PlateCarree())
@@ -724,12 +815,167 @@ def plot_diff_withobs(gridfile, cmin, cmax, cmstep, cbstep,
     if title is not None:
         ax.set_title(title, loc='left', fontdict={'fontsize': 16, 'fontweight': 'bold'})
 
-    cbar = plt.colorbar(cf)
+    cbar = plt.colorbar(cf, spacing='proportional')
     cbar.set_ticks(colorbar_ticks)
     if colorbar_label is not None:
         cbar.set_label(colorbar_label)
 
-    plt.show()
-    
-    if outpath is not None:
-        fig.savefig(outpath, dpi=300, bbox_inches='tight')
\ No newline at end of file
+    finish_figure(fig, outpath, show=show, dpi=preview_dpi if preview else 300)
+
+#==================================================================
+# Batch rendering: static base layers built once per layout,
+# only the data layers are swapped between figures
+#==================================================================
+
+PRD_extent = [111.2, 115.5, 21.4, 24.5]
+
+# layout: (number of panels, label size, title size)
+map_layouts = {
+    'single': (1, None, 16),
+    'pair'  : (2, 20, 30),
+}
+
+def build_base_map(layout='single', dpi=300):
+    """
+    Figure with the static layers of a layout: axes, gridlines, extent,
+    PRD boundary and a fixed colorbar axes
+    """
+    npanel, labelsize, _ = map_layouts[layout]
+    fig = plt.figure(figsize=(12, 6), dpi=dpi)
+    ax = fig.subplots(1, npanel, subplot_kw={'projection': ccrs.PlateCarree()})
+    ax = list(np.atleast_1d(ax))
+
+    for axis in ax:
+        draw_PRD_boundary(axis)
+        gl = axis.gridlines(
+            xlocs=np.arange(-180, 180 + 1, 1), ylocs=np.arange(-90, 90 + 1, 1),
+            draw_labels=True, x_inline=False, y_inline=False,
+            linewidth=0, linestyle='--', color='gray')
+        gl.top_labels = False
+        gl.right_labels = False
+        gl.rotate_labels = False
+        if labelsize is not None:
+            gl.xlabel_style = {'size': labelsize}
+            gl.ylabel_style = {'size': labelsize}
+        axis.set_extent(PRD_extent, ccrs.PlateCarree())
+
+    fig.subplots_adjust(right=0.9)
+    cax = fig.add_axes([0.92, 0.25, 0.02, 0.5])
+    return dict(fig=fig, ax=ax, cax=cax, layout=layout)
+
+def _remove_artist(artist):
+    # ContourSet is a single Collection since matplotlib 3.8
+    if isinstance(artist, mcollections.Collection) or not hasattr(artist, 'collections'):
+        artist.remove()
+    else:
+        for item in artist.collections:
+            item.remove()
+
+def render_map(base, lon, lat, job, dpi=300):
+    """
+    Draw the data layers of one job on a base map, save it and remove the
+    data layers again.
+
+    job (dict): data (2D array, or a list of one per panel), cmin, cmax,
+    cmstep, cbstep, and optional uwind/vwind/ngrid/scale/headwidth,
+    obs/obslon/obslat, mapcolor, titles, colorbar_label, outpath, preview
+    """
+    fig, ax, cax = base['fig'], base['ax'], base['cax']
+    _, labelsize, titlesize = map_layouts[base['layout']]
+    npanel = len(ax)
+
+    def per_panel(value):
+        if value is None or (isinstance(value, (list, tuple)) and len(value) == npanel):
+            return value if value is not None else [None]*npanel
+        return [value]*npanel
+
+    cmin, cmax = job['cmin'], job['cmax']
+    contourf_ticks = np.arange(cmin, cmax+job['cmstep']/2, job['cmstep'])
+    colorbar_ticks = np.arange(cmin, cmax+0.01, job['cbstep'])
+    colormap = job.get('mapcolor') or 'Spectral_r'
+    norm = mcolors.Normalize(vmin=cmin, vmax=cmax)
+
+    data = per_panel(job['data'])
+    uwind = per_panel(job.get('uwind'))
+    vwind = per_panel(job.get('vwind'))
+    obs = per_panel(job.get('obs'))
+    titles = per_panel(job.get('titles'))
+    ngrid, scale, headwidth = job.get('ngrid'), job.get('scale'), job.get('headwidth')
+    preview = job.get('preview', False)
+
+    artists = []
+    for i in range(npanel):
+        cf = draw_field(ax[i], lon, lat, data[i], colormap, contourf_ticks, preview)
+        artists.append(cf)
+
+        if uwind[i] is not None and ngrid is not None and scale is not None and headwidth is not None:
+            xgrid = np.size(uwind[i], 1)
+            ygrid = np.size(uwind[i], 0)
+            qv = ax[i].quiver(lon[0:ygrid:ngrid, 0:xgrid:ngrid], lat[0:ygrid:ngrid, 0:xgrid:ngrid],
+                              uwind[i][0:ygrid:ngrid, 0:xgrid:ngrid], vwind[i][0:ygrid:ngrid, 0:xgrid:ngrid],
+                              transform=ccrs.PlateCarree(), color='k', alpha=1, scale=scale, headwidth=headwidth)
+            clip_by_PRD(qv, ax[i])
+            artists.append(qv)
+
+        if obs[i] is not None:
+            cs = ax[i].scatter(job['obslon'], job['obslat'], c=obs[i], cmap=colormap, marker='o', s=20,
+                               edgecolors='k', linewidths=0.5, norm=norm, transform=ccrs.PlateCarree())
+            artists.append(cs)
+
+        ax[i].set_title(titles[i] or '', loc='left', fontdict={'fontsize': titlesize, 'fontweight': 'bold'})
+
+    cax.cla()
+    cbar = fig.colorbar(cf, spacing='proportional', cax=cax, orientation='vertical')
+    cbar.set_ticks(colorbar_ticks)
+    if labelsize is not None:
+        cbar.ax.tick_params(labelsize=labelsize)
+    if job.get('colorbar_label') is not None:
+        cbar.set_label(job['colorbar_label'], fontsize=labelsize)
+
+    if job.get('outpath') is not None:
+        fig.savefig(job['outpath'], dpi=dpi, bbox_inches='tight')
+
+    for artist in artists:
+        _remove_artist(artist)
+    return job.get('outpath')
+
+def _render_jobs(args):
+    lon, lat, jobs, dpi, headless = args
+    if headless:
+        plt.switch_backend('Agg')
+    bases = {}
+    outpaths = []
+    for job in jobs:
+        layout = job.get('layout', 'single')
+        if layout not in bases:
+            bases[layout] = build_base_map(layout, dpi)
+        outpaths.append(render_map(bases[layout], lon, lat, job, dpi))
+    for base in bases.values():
+        plt.close(base['fig'])
+    return outpaths
+
+def render_batch(gridfile, jobs, n_workers=None, dpi=300):
+    """
+    Render a list of map jobs (see render_map) headless on a process pool.
+    Every worker builds the base map of each layout once and reuses it for
+    all of its jobs. Returns the output paths in job order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    lon = np.asarray(gridfile.longitude)
+    lat = np.asarray(gridfile.latitude)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(jobs)))
+
+    if n_workers == 1:
+        return _render_jobs((lon, lat, jobs, dpi, False))
+
+    # worker i renders jobs i, i+n_workers, ... and switches itself to Agg
+    chunks = [jobs[i::n_workers] for i in range(n_workers)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(_render_jobs, [(lon, lat, chunk, dpi, True) for chunk in chunks]))
+    outpaths = [None]*len(jobs)
+    for i, result in enumerate(results):
+        outpaths[i::n_workers] = result
+    return outpaths
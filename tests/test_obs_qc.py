@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.obs_qc import clean_obs, FLAG_OK, FLAG_MISSING, FLAG_RANGE, FLAG_SPIKE, FLAG_FILLED
+from src.obs_store import load_obs_store
+
+
+def make_store(path):
+    # same layout as build_obs_store: (variable, site, time) with site metadata
+    times = pd.date_range('2019-09-01T00', periods=48, freq='h')
+    values = np.full((2, 2, 48), 50.0, dtype='float32')
+    values += np.arange(48, dtype='float32') * 0.1
+    values[0, 0, 10] = np.nan      # missing, fillable
+    values[0, 1, 20] = 5000.0      # out of range
+    values[1, 0, 30] = 400.0       # spike
+    store = xr.DataArray(
+        values,
+        dims=('variable', 'site', 'time'),
+        coords=dict(
+            variable=['PM2.5', 'NO2'],
+            site=['1001A', '1002A'],
+            time=times,
+            city=('site', ['广州', '深圳']),
+            longitude=('site', [113.3, 114.1]),
+            latitude=('site', [23.1, 22.5]),
+        ),
+        name='obs',
+    )
+    store.to_netcdf(path)
+    return path
+
+
+def test_clean_obs_on_store(tmp_path):
+    store = load_obs_store(make_store(str(tmp_path / 'obs_store.nc')))
+    output = clean_obs(store)
+
+    flag = output.flag
+    assert int(flag.sel(variable='PM2.5', site='1001A').isel(time=10)) == FLAG_FILLED
+    assert int(flag.sel(variable='PM2.5', site='1002A').isel(time=20)) == FLAG_RANGE
+    assert int(flag.sel(variable='NO2', site='1001A').isel(time=30)) == FLAG_SPIKE
+    assert int(flag.sel(variable='NO2', site='1002A').isel(time=5)) == FLAG_OK
+    assert not (flag == FLAG_MISSING).any()
+
+    # rejected values are filled but keep the reason in flag
+    assert bool(output.filled.sel(variable='PM2.5', site='1002A').isel(time=20))
+    assert bool(output.filled.sel(variable='NO2', site='1001A').isel(time=30))
+    assert np.isfinite(output.obs.values).all()
+    assert float(output.obs.sel(variable='PM2.5', site='1002A').isel(time=20)) < 100
+    assert output.fraction.sizes['period'] == 2
+
+
+def test_clean_obs_spline_sparse_series(tmp_path):
+    store = load_obs_store(make_store(str(tmp_path / 'obs_store_sparse.nc')))
+    # a near-empty series: 2 valid points around a short gap
+    sparse = np.full(store.sizes['time'], np.nan, dtype='float32')
+    sparse[[3, 5]] = 40.0
+    store = store.copy()
+    store.loc[dict(variable='NO2', site='1002A')] = sparse
+
+    output = clean_obs(store, method='spline')
+
+    sparse_out = output.obs.sel(variable='NO2', site='1002A')
+    assert int(sparse_out.notnull().sum()) == 2
+    assert not bool(output.filled.sel(variable='NO2', site='1002A').any())
+    # the other series are still filled by the spline
+    assert bool(output.filled.sel(variable='PM2.5', site='1001A').isel(time=10))
+    assert np.isfinite(output.obs.sel(variable='PM2.5', site='1001A').values).all()
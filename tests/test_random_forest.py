@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from src.RandomForest import rf_importance
+
+
+def make_table(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(size=(n, 3)), columns=['T2', 'RH', 'WS'])
+    df['O3'] = 3*df['T2'] - df['RH'] + 0.1*rng.normal(size=n)
+    return df
+
+
+def test_rf_importance_oob():
+    df = make_table()
+    output = rf_importance(df, ['T2', 'RH', 'WS'], 'O3', estimator='rf',
+                           importance='oob', n_estimators=30)
+    assert list(output.index) == ['T2', 'RH', 'WS', 'mse', 'r2']
+    value = output['value']
+    assert np.isfinite(value).all()
+    assert value['T2'] > value['RH'] > value['WS']
+    assert value['r2'] > 0.8